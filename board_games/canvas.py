@@ -1,4 +1,13 @@
-# from collections import deque
+import sys
+from collections import deque
+from itertools import count
+from threading import Lock
+from time import perf_counter, perf_counter_ns, sleep
+from typing import Callable, Dict, List, Tuple
+try:
+    import numpy as np  # optional, Board(framebuffer=True) keeps the frame as a uint8 color index array
+except ImportError:
+    np = None
 
 COLOR = {
     "Black":  "\033[30m",
@@ -9,6 +18,15 @@ COLOR = {
     "White":  "\033[107m",
     "Reset":  "\033[0m",
 }
+COLOR_NAMES = list(COLOR)
+COLOR_INDEX = {name: index for index, name in enumerate(COLOR_NAMES)}
+
+
+def fill(patch, r_min: int, c_min: int, r_1: int, c_1: int, r_2: int, c_2: int, color: str):  # inclusive rectangle, clipped to the patch
+    r_1, c_1 = max(r_1 - r_min, 0), max(c_1 - c_min, 0)
+    r_2, c_2 = min(r_2 - r_min, patch.shape[0] - 1), min(c_2 - c_min, patch.shape[1] - 1)
+    if r_1 <= r_2 and c_1 <= c_2:
+        patch[r_1:r_2 + 1, c_1:c_2 + 1] = COLOR_INDEX[color]
 
 
 class Grid:
@@ -34,10 +52,46 @@ class Shape:
     def __init__(self, outline_color: str = "Black", filled_color: str = None):
         self.outline_color = outline_color
         self.filled_color = filled_color
+        self.cache = None  # (geometry, raster, numpy arrays of the raster or None)
 
     def generate_grids(self):
         pass
 
+    def bounds(self) -> Tuple[int, int, int, int]:  # r_min, c_min, r_max, c_max
+        pass
+
+    def state(self) -> tuple:  # anything that changes the rasterized cells, compared between frames
+        return self.outline_color, self.filled_color
+
+    def geometry(self) -> tuple:  # what the cells look like regardless of where the shape is, None never caches
+        return None
+
+    def raster(self) -> Dict[Tuple[int, int], str]:  # {(row, col) relative to the top left of bounds: color}
+        # rasterized again only when the geometry changes, a move just shifts where the cached cells are blitted
+        key = self.geometry()
+        if key is None or self.cache is None or self.cache[0] != key:
+            r_0, c_0 = self.bounds()[:2]
+            self.cache = (key, {(r - r_0, c - c_0): g.color for r, c, g in self.generate_grids()}, None)
+        return self.cache[1]
+
+    def raster_arrays(self) -> tuple:  # rows, cols and COLOR_INDEX values of raster() for framebuffer mode
+        cells = self.raster()
+        if self.cache[2] is None:
+            self.cache = self.cache[:2] + ((np.array([r for r, _ in cells], dtype=np.int64).reshape(-1), np.array([c for _, c in cells], dtype=np.int64).reshape(-1),
+                                            np.array([COLOR_INDEX[color] for color in cells.values()], dtype=np.uint8).reshape(-1)),)
+        return self.cache[2]
+
+    def covers(self, row: int, col: int) -> bool:  # hit test of one cell against the cached raster
+        r_0, c_0 = self.bounds()[:2]
+        return (row - r_0, col - c_0) in self.raster()
+
+    def paint(self, patch, r_min: int, c_min: int):  # framebuffer mode, patch[0, 0] is cell (r_min, c_min), the cached raster shifted into place
+        rows, cols, colors = self.raster_arrays()
+        r_0, c_0 = self.bounds()[:2]
+        rows, cols = rows + (r_0 - r_min), cols + (c_0 - c_min)
+        inside = (rows >= 0) & (rows < patch.shape[0]) & (cols >= 0) & (cols < patch.shape[1])
+        patch[rows[inside], cols[inside]] = colors[inside]
+
     def move(self, direction: Point):
         pass
 
@@ -48,23 +102,32 @@ class Line(Shape):
         self.point_1 = point_1
         self.point_2 = point_2
 
-    def generate_grids(self):
-        # (x - x1) / (x2 - x1) = (y - y1) / (y2 - y1)
-        r1, c1, r2, c2 = self.point_1.row, self.point_1.col, self.point_2.row, self.point_2.col
-        if abs(r1 - r2) > abs(c1 - c2):
-            if r1 > r2:
-                r1, r2 = r2, r1
-                c1, c2 = c2, c1
-            for r in range(r1, r2 + 1):
-                c = (r - r1) * (c2 - c1) / (r2 - r1) + c1
-                yield (r, round(c), Grid(color=self.outline_color))
-        else:
-            if c1 > c2:
-                r1, r2 = r2, r1
-                c1, c2 = c2, c1
-            for c in range(c1, c2 + 1):
-                r = (r2 - r1) * (c - c1) / (c2 - c1) + r1
-                yield (round(r), c, Grid(color=self.outline_color))
+    def generate_grids(self):  # Bresenham from point_1 to point_2, integer steps only
+        r, c, r2, c2 = self.point_1.row, self.point_1.col, self.point_2.row, self.point_2.col
+        d_r, d_c = -abs(r2 - r), abs(c2 - c)
+        s_r, s_c = 1 if r < r2 else -1, 1 if c < c2 else -1
+        error = d_c + d_r
+        while True:
+            yield (r, c, Grid(color=self.outline_color))
+            if r == r2 and c == c2:
+                return
+            step = 2 * error
+            if step >= d_r:
+                error += d_r
+                c += s_c
+            if step <= d_c:
+                error += d_c
+                r += s_r
+
+    def bounds(self) -> Tuple[int, int, int, int]:
+        return min(self.point_1.row, self.point_2.row), min(self.point_1.col, self.point_2.col), \
+               max(self.point_1.row, self.point_2.row), max(self.point_1.col, self.point_2.col)
+
+    def state(self) -> tuple:
+        return super().state() + (self.point_1.row, self.point_1.col, self.point_2.row, self.point_2.col)
+
+    def geometry(self) -> tuple:  # Bresenham only depends on the offset between the end points
+        return self.outline_color, self.point_2.row - self.point_1.row, self.point_2.col - self.point_1.col
 
     def move(self, direction: Point):
         self.point_1.move(direction)
@@ -91,44 +154,250 @@ class Rectangle(Shape):
                 for c in range(c_min + 1, c_max):
                     yield (r, c, Grid(color=self.filled_color))
 
+    def bounds(self) -> Tuple[int, int, int, int]:
+        return min(self.point_1.row, self.point_2.row), min(self.point_1.col, self.point_2.col), \
+               max(self.point_1.row, self.point_2.row), max(self.point_1.col, self.point_2.col)
+
+    def state(self) -> tuple:
+        return super().state() + (self.point_1.row, self.point_1.col, self.point_2.row, self.point_2.col)
+
+    def geometry(self) -> tuple:
+        r_1, c_1, r_2, c_2 = self.bounds()
+        return self.outline_color, self.filled_color, r_2 - r_1, c_2 - c_1
+
+    def covers(self, row: int, col: int) -> bool:  # no raster needed
+        r_1, c_1, r_2, c_2 = self.bounds()
+        if not (r_1 <= row <= r_2 and c_1 <= col <= c_2):
+            return False
+        return self.filled_color is not None or row in (r_1, r_2) or col in (c_1, c_2)
+
+    def paint(self, patch, r_min: int, c_min: int):  # slice assignments, interior first so the outline wins on thin rectangles
+        r_1, c_1, r_2, c_2 = self.bounds()
+        if self.filled_color is not None:
+            fill(patch, r_min, c_min, r_1 + 1, c_1 + 1, r_2 - 1, c_2 - 1, self.filled_color)
+        for edge in ((r_1, c_1, r_1, c_2), (r_2, c_1, r_2, c_2), (r_1, c_1, r_2, c_1), (r_1, c_2, r_2, c_2)):
+            fill(patch, r_min, c_min, *edge, self.outline_color)
+
     def move(self, direction: Point):
         self.point_1.move(direction)
         self.point_2.move(direction)
 
 
+def intersects(bounds: Tuple[int, int, int, int], r_min: int, c_min: int, r_max: int, c_max: int) -> bool:
+    return not (bounds[2] < r_min or bounds[0] > r_max or bounds[3] < c_min or bounds[1] > c_max)
+
+
+class SpatialIndex:  # uniform grid over the unbounded canvas, a shape is filed under every bucket its bounds overlap
+    def __init__(self, bucket: int = 16, max_buckets: int = 256):
+        self.bucket = bucket
+        self.max_buckets = max_buckets  # shapes spanning more buckets go to self.large and are checked on every query
+        self.buckets = dict()           # <(bucket_row, bucket_col), set of shapes>
+        self.boxes = dict()             # <Shape, bounds> as indexed
+        self.large = set()
+
+    def span(self, r_min: int, c_min: int, r_max: int, c_max: int) -> Tuple[range, range]:
+        return range(r_min // self.bucket, r_max // self.bucket + 1), range(c_min // self.bucket, c_max // self.bucket + 1)
+
+    def insert(self, shape: Shape, bounds: Tuple[int, int, int, int]):
+        if self.boxes.get(shape) == bounds:
+            return
+        self.remove(shape)
+        self.boxes[shape] = bounds
+        rows, cols = self.span(*bounds)
+        if len(rows) * len(cols) > self.max_buckets:
+            self.large.add(shape)
+            return
+        for br in rows:
+            for bc in cols:
+                self.buckets.setdefault((br, bc), set()).add(shape)
+
+    def remove(self, shape: Shape):
+        bounds = self.boxes.pop(shape, None)
+        if bounds is None:
+            return
+        if shape in self.large:
+            self.large.remove(shape)
+            return
+        rows, cols = self.span(*bounds)
+        for br in rows:
+            for bc in cols:
+                bucket = self.buckets[(br, bc)]
+                bucket.remove(shape)
+                if not bucket:
+                    del self.buckets[(br, bc)]
+
+    def query(self, r_min: int, c_min: int, r_max: int, c_max: int) -> set:  # shapes whose bounds intersect the region
+        rows, cols = self.span(r_min, c_min, r_max, c_max)
+        found = set(self.large)
+        if len(rows) * len(cols) > len(self.buckets):  # a region wider than the occupied buckets, walk those instead
+            for (br, bc), shapes in self.buckets.items():
+                if br in rows and bc in cols:
+                    found.update(shapes)
+        else:
+            for br in rows:
+                for bc in cols:
+                    found.update(self.buckets.get((br, bc), ()))
+        return {shape for shape in found if intersects(self.boxes[shape], r_min, c_min, r_max, c_max)}
+
+
 class Board:
-    def __init__(self, row: int, col: int, background_color: str = "White"):
-        self.row_len = row
+    def __init__(self, row: int, col: int, background_color: str = "White", grid_size: int = 2, framebuffer: bool = False):
+        if framebuffer and np is None:
+            raise ImportError("Board(framebuffer=True) needs numpy")
+        self.row_len = row    # the viewport, a fixed window over the unbounded canvas shapes are drawn on
         self.col_len = col
+        self.origin = Point(0, 0)  # canvas cell shown at the top left of the viewport
         self.shapes = dict()  # <Shape, int_layer>
         self.layers = list()
-        self.matrix = None
+        self.order = dict()   # <Shape, draw sequence>, breaks ties within a layer
+        self.drawn = count()
+        self.index = SpatialIndex()
+        self.matrix = None    # composed viewport, a color name per cell, or a 2-D uint8 array of COLOR_INDEX values in framebuffer mode
+        self.framebuffer = framebuffer
         self.background_color = background_color
+        self.grid_size = grid_size
+        self.rendered = dict()  # <Shape, (layer, state, bounds)> as composed into the matrix
+        self.panned = False     # the viewport moved, every cell of it is composed again
+        self.screen = None      # (row_len, col_len) of the frame update() left on the terminal
+        self.timings = {"rasterize": 0, "composite": 0}  # ns spent by compose(), running totals
 
     def clear(self):
         # self.matrix = deque([deque([Grid(color=self.background_color) for _ in range(self.col_len)]) for _ in range(self.row_len)])
-        self.matrix = [[Grid(color=self.background_color) for _ in range(self.col_len)] for _ in range(self.row_len)]
-
-    def expand(self, row, col):
-        while row >= len(self.matrix):
-            self.matrix.append([Grid(color=self.background_color) for _ in range(self.col_len)])
-        self.row_len = len(self.matrix)
-        while col >= len(self.matrix[0]):
-            for r in range(self.row_len):
-                self.matrix[r].append(Grid(color=self.background_color))
-        self.col_len = len(self.matrix[0])
+        if self.framebuffer:
+            self.matrix = np.full((self.row_len, self.col_len), COLOR_INDEX[self.background_color], dtype=np.uint8)
+        else:
+            self.matrix = [[self.background_color] * self.col_len for _ in range(self.row_len)]
+        self.rendered = dict()
+
+    def pan(self, direction: Point):  # moves the viewport over the canvas instead of growing the board
+        self.origin.move(direction)
+        self.panned = True
+
+    def viewport(self) -> Tuple[int, int, int, int]:  # canvas bounds of the viewport
+        return self.origin.row, self.origin.col, self.origin.row + self.row_len - 1, self.origin.col + self.col_len - 1
+
+    def track(self) -> dict:  # <Shape, (layer, state, bounds)> now, shapes moved by Shape.move are filed again in the index
+        current = dict()
+        for shape, layer in self.shapes.items():
+            bounds = shape.bounds()
+            current[shape] = (layer, shape.state(), bounds)
+            self.index.insert(shape, bounds)  # a no-op unless the shape moved or resized
+        return current
+
+    def visible(self, r_min: int, c_min: int, r_max: int, c_max: int) -> List[Shape]:  # bottom layer first, then in draw order
+        return sorted(self.index.query(r_min, c_min, r_max, c_max), key=lambda s: (self.shapes[s], self.order[s]))
+
+    def shape_at(self, row: int, col: int):  # topmost shape covering canvas cell (row, col), or None
+        # sees shapes moved by Board.move at once, shapes moved by Shape.move from the next frame on
+        for shape in reversed(self.visible(row, col, row, col)):
+            if shape.covers(row, col):
+                return shape
+        return None
+
+    def compose(self, diff: bool = True) -> Dict[int, Dict[int, str]]:  # {row: {col: color}} of the viewport cells changed since the last frame if diff
+        # only the regions of shapes added, moved, recolored, relayered or deleted since the last frame are redrawn, clipped to the viewport
+        if self.matrix is None:
+            self.clear()
+        current = self.track()
+        view = self.viewport()
+        dirty = [view] if self.panned else list()
+        for shape, (layer, state, bounds) in current.items():
+            previous = self.rendered.get(shape)
+            if not self.panned and (previous is None or previous[:2] != (layer, state)):
+                dirty.append(bounds)
+                if previous is not None:
+                    dirty.append(previous[2])
+        if not self.panned:
+            dirty.extend(bounds for shape, (_, _, bounds) in self.rendered.items() if shape not in current)
+        self.rendered, self.panned = current, False
+        changes = dict()
+        for r_min, c_min, r_max, c_max in dirty:
+            r_min, c_min, r_max, c_max = max(r_min, view[0]), max(c_min, view[1]), min(r_max, view[2]), min(c_max, view[3])
+            if r_min > r_max or c_min > c_max:
+                continue  # off screen, nothing is rasterized
+            shapes = self.visible(r_min, c_min, r_max, c_max)
+            if self.framebuffer:
+                self.compose_array(r_min, c_min, r_max, c_max, shapes, changes if diff else None)
+                continue
+            start = perf_counter_ns()
+            patch = [[self.background_color] * (c_max - c_min + 1) for _ in range(r_max - r_min + 1)]
+            for s in shapes:
+                r_0, c_0 = current[s][2][:2]  # the move offset, applied while blitting the cached raster
+                for (r, c), color in s.raster().items():
+                    r, c = r + r_0 - r_min, c + c_0 - c_min
+                    if 0 <= r < len(patch) and 0 <= c < len(patch[0]):
+                        patch[r][c] = color
+            rasterized = perf_counter_ns()
+            for r in range(r_min, r_max + 1):
+                row, patch_row = self.matrix[r - view[0]], patch[r - r_min]
+                for c in range(c_min, c_max + 1):
+                    color = patch_row[c - c_min]
+                    if row[c - view[1]] != color:
+                        row[c - view[1]] = color
+                        if diff:
+                            changes.setdefault(r - view[0], dict())[c - view[1]] = color
+            self.timings["rasterize"] += rasterized - start
+            self.timings["composite"] += perf_counter_ns() - rasterized
+        return changes
+
+    def compose_array(self, r_min: int, c_min: int, r_max: int, c_max: int, shapes: List[Shape], changes: Dict[int, Dict[int, str]] = None):
+        start = perf_counter_ns()
+        patch = np.full((r_max - r_min + 1, c_max - c_min + 1), COLOR_INDEX[self.background_color], dtype=np.uint8)
+        for s in shapes:  # later layers overwrite the cells they cover
+            s.paint(patch, r_min, c_min)
+        rasterized = perf_counter_ns()
+        r_min, c_min, r_max, c_max = r_min - self.origin.row, c_min - self.origin.col, r_max - self.origin.row, c_max - self.origin.col
+        region = self.matrix[r_min:r_max + 1, c_min:c_max + 1]
+        if changes is not None:
+            for r, c in zip(*(indices.tolist() for indices in np.nonzero(patch != region))):
+                changes.setdefault(r + r_min, dict())[c + c_min] = COLOR_NAMES[patch[r, c]]
+        region[...] = patch
+        self.timings["rasterize"] += rasterized - start
+        self.timings["composite"] += perf_counter_ns() - rasterized
+
+    def run(self, colors: List[str]) -> str:  # one escape per run of equal colors instead of one per cell
+        text, start = "", 0
+        for i in range(1, len(colors) + 1):
+            if i == len(colors) or colors[i] != colors[start]:
+                text += COLOR[colors[start]] + " " * (self.grid_size * (i - start))
+                start = i
+        return text + COLOR["Reset"]
+
+    def frame(self) -> str:
+        if self.framebuffer:
+            return "".join(self.run([COLOR_NAMES[index] for index in row]) + "\n" for row in self.matrix.tolist())
+        return "".join(self.run(row) + "\n" for row in self.matrix)
 
     def print(self):
-        self.clear()
-        for shapes in self.layers:
-            for s in shapes:
-                for r, c, g in s.generate_grids():
-                    self.expand(r, c)
-                    self.matrix[r][c] = g
-        for r in range(self.row_len):
-            for c in range(self.col_len):
-                print(self.matrix[r][c], end="")
-            print()
+        self.compose(diff=False)
+        sys.stdout.write(self.frame())  # one buffered write per frame
+        sys.stdout.flush()
+        self.screen = None  # printed below whatever came before, refresh() starts over
+
+    def update(self) -> str:  # escapes that bring the frame the last update() drew up to date in place, only the changed cells
+        changes = self.compose(diff=self.screen == (self.row_len, self.col_len))  # a first frame is written whole
+        text = ""
+        if self.screen != (self.row_len, self.col_len):
+            text = self.frame()
+        elif changes:
+            out, cursor = list(), self.row_len  # the cursor rests on the line below the frame
+            for r in sorted(changes):
+                out.append(f"\033[{cursor - r}A" if cursor > r else f"\033[{r - cursor}B" if cursor < r else "")
+                cursor = r
+                cols = sorted(changes[r])
+                start = 0
+                for i in range(1, len(cols) + 1):  # runs of adjacent changed cells share one cursor move
+                    if i == len(cols) or cols[i] != cols[i - 1] + 1:
+                        out.append(f"\033[{cols[start] * self.grid_size + 1}G" + self.run([changes[r][c] for c in cols[start:i]]))
+                        start = i
+            out.append(f"\033[{self.row_len - cursor}B\r")
+            text = "".join(out)
+        self.screen = (self.row_len, self.col_len)
+        return text
+
+    def refresh(self):
+        sys.stdout.write(self.update())  # one buffered write per frame
+        sys.stdout.flush()
 
     def draw(self, shape: Shape, layer: int = -1):
         if layer == -1:
@@ -136,8 +405,16 @@ class Board:
             layer = len(self.layers) - 1
         while layer > len(self.layers) - 1:
             self.layers.append(set())
+        if shape not in self.order:
+            self.order[shape] = next(self.drawn)
         self.shapes[shape] = layer
         self.layers[layer].add(shape)
+        self.index.insert(shape, shape.bounds())
+
+    def move(self, shape: Shape, direction: Point):  # Shape.move that keeps hit tests current before the next frame
+        shape.move(direction)
+        if shape in self.shapes:
+            self.index.insert(shape, shape.bounds())
 
     def layer_move(self, shape: Shape, layer_offset: int):
         if shape in self.shapes:
@@ -158,7 +435,107 @@ class Board:
         if shape in self.shapes:
             layer = self.shapes[shape]
             del self.shapes[shape]
+            del self.order[shape]
             self.layers[layer].remove(shape)
+            self.index.remove(shape)
+
+
+class Animation:  # frame loop over a Board, mutations queued between frames are applied together right before the next one
+    SYNC = ("\033[?2026h", "\033[?2026l")  # synchronized output, terminals that support it show a frame only once all of it arrived
+    CURSOR = ("\033[?25l", "\033[?25h")    # hidden while animating
+
+    def __init__(self, board: Board, fps: float = 30, history: int = 600):
+        self.board = board
+        self.fps = fps
+        self.lock = Lock()     # mutations may be queued from other threads while run() loops
+        self.pending = list()  # [(Board method, args)] in the order queued
+        self.moves = dict()    # <Shape, its move in pending>, later moves of the shape are added to it
+        self.frames = deque(maxlen=history)  # (rasterize_ns, composite_ns, write_ns, bytes) of the latest frames
+        self.count = 0
+        self.dropped = 0       # frame slots missed because a frame took longer than 1 / fps
+        self.elapsed = 0.0
+        self.running = False
+
+    def queue(self, method: str, *args):
+        with self.lock:
+            if method == "layer_move" and self.pending and self.pending[-1][0] == method and self.pending[-1][1][0] is args[0]:
+                args = (args[0], self.pending.pop()[1][1] + args[1])  # one relayer for back to back layer moves
+            self.pending.append((method, args))
+
+    def draw(self, shape: Shape, layer: int = -1):
+        self.queue("draw", shape, layer)
+
+    def move(self, shape: Shape, direction: Point):
+        with self.lock:
+            move = self.moves.get(shape)
+            if move is not None:
+                move.move(direction)  # coalesced, the shape is moved and redrawn once per frame
+                return
+            move = self.moves[shape] = Point(direction.row, direction.col)
+            self.pending.append(("move", (shape, move)))
+
+    def layer_move(self, shape: Shape, layer_offset: int):
+        self.queue("layer_move", shape, layer_offset)
+
+    def layer_swap(self, shape_1: Shape, shape_2: Shape):
+        self.queue("layer_swap", shape_1, shape_2)
+
+    def delete(self, shape: Shape):
+        self.queue("delete", shape)
+
+    def pan(self, direction: Point):
+        self.queue("pan", Point(direction.row, direction.col))
+
+    def apply(self):
+        with self.lock:
+            pending, self.pending, self.moves = self.pending, list(), dict()
+        for method, args in pending:
+            getattr(self.board, method)(*args)
+
+    def frame(self):
+        rasterize, composite = self.board.timings["rasterize"], self.board.timings["composite"]
+        self.apply()
+        text = self.board.update()  # composed into the matrix, the back buffer, nothing is on screen yet
+        start = perf_counter_ns()
+        sys.stdout.write(self.SYNC[0] + text + self.SYNC[1])  # the whole frame in one write
+        sys.stdout.flush()
+        self.frames.append((self.board.timings["rasterize"] - rasterize, self.board.timings["composite"] - composite, perf_counter_ns() - start, len(text)))
+        self.count += 1
+
+    def run(self, frames: int = None, step: Callable = None):  # step(animation, frame) queues the mutations of each frame
+        period, frame = 1 / self.fps, 0
+        start = deadline = perf_counter()
+        self.running = True
+        sys.stdout.write(self.CURSOR[0])
+        try:
+            while self.running and (frames is None or frame < frames):
+                if step is not None:
+                    step(self, frame)
+                self.frame()
+                frame += 1
+                deadline += period
+                now = perf_counter()
+                if now > deadline:  # over budget, skip the slots already missed instead of rushing to catch up
+                    missed = int((now - deadline) / period) + 1
+                    self.dropped += missed
+                    deadline += missed * period
+                sleep(max(deadline - now, 0))
+        finally:
+            self.running = False
+            self.elapsed += perf_counter() - start
+            sys.stdout.write(self.CURSOR[1])
+            sys.stdout.flush()
+
+    def stop(self):  # from another thread or from step
+        self.running = False
+
+    def stats(self) -> dict:  # milliseconds, over the latest frames
+        result = {"frames": self.count, "dropped": self.dropped, "fps": round(self.count / self.elapsed, 1) if self.elapsed else 0.0}
+        for i, phase in enumerate(("rasterize", "composite", "write")):
+            values = [frame[i] for frame in self.frames]
+            result[phase] = {"mean": round(sum(values) / len(values) / 1e6, 3) if values else 0.0, "max": round(max(values, default=0) / 1e6, 3)}
+        result["bytes"] = round(sum(frame[3] for frame in self.frames) / len(self.frames)) if self.frames else 0
+        return result
 
 
 print("Draw a line, a blue rectangle and a green square with red border")
@@ -182,11 +559,23 @@ board.print()
 print("Delete the red/green square")
 board.delete(rectangle_2)
 board.print()
-print("Move the line out of the border and force the board to expand")
+print("Move the line partly out of the viewport")
 line.move(Point(3, 4))
 board.print()
+print("Pan the viewport to follow the line")
+board.pan(Point(3, 4))
+board.print()
+print("Animate the red/green square back and forth at 20 frames per second")
+animation = Animation(board, fps=20)
+animation.pan(Point(-3, -4))
+animation.draw(rectangle_2)
 
 
+def slide(animation: Animation, frame: int):
+    animation.move(rectangle_2, Point(0, 1 if frame % 6 < 3 else -1))
+    animation.layer_move(rectangle_2, 1)  # queued moves and layer moves of one frame are applied and redrawn together
+    animation.layer_move(rectangle_2, -1)
 
 
-
+animation.run(12, slide)
+print(animation.stats())
@@ -0,0 +1,238 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+from order_matching_engine import EventLog, LatencyHistogram, MatchingEngine, Order
+from statistics import median
+from threading import Barrier, Thread
+from time import perf_counter_ns, sleep, time
+from typing import List
+
+
+MID_TICKS = 10000   # 100.00 at the default 0.01 tick size, resting asks above and bids below
+TICK_SIZE = 0.01
+BOOK_LEVELS = 1000  # price levels per side the resting book is spread over
+
+
+def order_size(rng: random.Random, sizes: str) -> int:
+    if sizes == "fixed":
+        return 1
+    if sizes == "uniform":
+        return rng.randint(1, 100)
+    return min(int(rng.paretovariate(1.5)), 10000)  # pareto: mostly small orders with a heavy tail of large ones
+
+
+def build_book(engine: MatchingEngine, rng: random.Random, depth: int, symbols: List[str], sizes: str) -> List[int]:
+    orders = list()
+    for order_id in range(depth):
+        side = "ask" if order_id % 2 == 0 else "bid"
+        level = rng.randint(1, BOOK_LEVELS)
+        ticks = MID_TICKS + level if side == "ask" else MID_TICKS - level
+        orders.append(Order(order_id, symbols[order_id % len(symbols)], side, ticks * TICK_SIZE, order_size(rng, sizes), f"Maker_{order_id % 100}", 3600))
+        if len(orders) == 10000:
+            list(engine.accept_orders(orders))  # never crosses, nothing to match
+            orders = list()
+    list(engine.accept_orders(orders))
+    return list(range(depth))
+
+
+def generate_operations(rng: random.Random, operations: int, first_order_id: int, resting: List[int], cancels: float, symbols: List[str], sizes: str) -> list:
+    result = list()  # built before the clock starts: ("accept", Order) or ("cancel", order_id)
+    for order_id in range(first_order_id, first_order_id + operations):
+        if resting and rng.random() < cancels / (1 + cancels):  # cancels per accepted order
+            index = rng.randrange(len(resting))
+            resting[index], resting[-1] = resting[-1], resting[index]
+            result.append(("cancel", resting.pop()))
+        else:
+            side = rng.choice(("ask", "bid"))
+            ticks = MID_TICKS + rng.randint(-5, 5)  # around the touch, so a share of the orders cross
+            result.append(("accept", Order(order_id, rng.choice(symbols), side, ticks * TICK_SIZE, order_size(rng, sizes), f"Taker_{order_id % 100}", 3600)))
+            resting.append(order_id)
+    return result
+
+
+def submit(engine: MatchingEngine, operations: list, barrier: Barrier, latency: LatencyHistogram, rejects: list):
+    barrier.wait()
+    for action, argument in operations:
+        start = perf_counter_ns()
+        try:
+            if action == "accept":
+                engine.accept_order(argument)
+            else:
+                engine.cancel_order(argument)
+        except ValueError:  # cancel of an order filled meanwhile
+            rejects.append(argument)
+        latency.record(perf_counter_ns() - start)
+
+
+def bench_engine(depth: int, cancels: float, sizes: str, symbols: int, threads: int, operations: int, seed: int, warmup: int = 0) -> dict:
+    rng = random.Random(seed)
+    quiet_logger = logging.getLogger("order_benchmark")
+    quiet_logger.disabled = True
+    engine = MatchingEngine(logger=quiet_logger, event_level=EventLog.OFF)
+    names = [f"SYM{i}" for i in range(symbols)]
+    engine.load_symbols(names)
+    resting = build_book(engine, rng, depth, names, sizes)
+    warmup_work = generate_operations(rng, warmup, depth, resting, cancels, names, sizes)
+    submit(engine, warmup_work, Barrier(1), LatencyHistogram(), list())  # untimed, warms the caches, the allocator and the free price levels
+    work = generate_operations(rng, operations, depth + warmup, resting, cancels, names, sizes)
+    barrier = Barrier(threads + 1)
+    histograms, rejects = [LatencyHistogram() for _ in range(threads)], list()
+    workers = [Thread(target=submit, args=(engine, work[i::threads], barrier, histograms[i], rejects)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = perf_counter_ns()
+    for worker in workers:
+        worker.join()
+    elapsed = (perf_counter_ns() - start) / 1e9
+    latency = LatencyHistogram()
+    for histogram in histograms:
+        latency.merge(histogram)
+    engine.close()
+    return report(latency, elapsed, operations, len(rejects), engine.history.total)
+
+
+def bench_http(operations: int, port: int, seed: int, warmup: int = 0) -> dict:
+    service = os.path.join(os.path.dirname(os.path.abspath(__file__)), "order_matching_service.py")
+    server = subprocess.Popen([sys.executable, service, "-p", str(port), "-s", "SYM0", "-l", "off"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):  # wait for the listener
+            try:
+                socket.create_connection(("localhost", port), timeout=0.1).close()
+                break
+            except OSError:
+                sleep(0.1)
+        rng = random.Random(seed)
+        work = generate_operations(rng, warmup + operations, 0, list(), 0, ["SYM0"], "uniform")
+        bodies = [json.dumps(order.to_dict()) for _, order in work]
+        connection = http.client.HTTPConnection("localhost", port)  # reopened by http.client if the server closes it
+        for body in bodies[:warmup]:  # untimed
+            connection.request("POST", "/order", body, {"Content-Type": "application/json"})
+            connection.getresponse().read()
+        latency, rejects = LatencyHistogram(), 0
+        start = perf_counter_ns()
+        for body in bodies[warmup:]:
+            request_start = perf_counter_ns()
+            connection.request("POST", "/order", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            rejects += response.status != 200
+            latency.record(perf_counter_ns() - request_start)
+        elapsed = (perf_counter_ns() - start) / 1e9
+        connection.close()
+        return report(latency, elapsed, operations, rejects, None)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(latency: LatencyHistogram, elapsed: float, operations: int, rejects: int, fills: int) -> dict:
+    p50, p90, p99, p999 = latency.percentiles([50, 90, 99, 99.9])
+    return {
+        "operations": operations, "rejects": rejects, "fills": fills, "elapsed_sec": round(elapsed, 6),
+        "operations_per_sec": round(operations / elapsed, 1) if elapsed else 0.0,
+        "latency_us": {"p50": p50 / 1e3, "p90": p90 / 1e3, "p99": p99 / 1e3, "p99.9": p999 / 1e3, "max": latency.max / 1e3}
+    }
+
+
+def summarize(runs: List[dict]) -> dict:  # medians over the repeats, with their spread so a comparison can tell a change from noise
+    ops = sorted(run["operations_per_sec"] for run in runs)
+    result = dict(min(runs, key=lambda run: abs(run["operations_per_sec"] - median(ops))))  # counts and elapsed time of the median run
+    result["operations_per_sec"] = round(median(ops), 1)
+    result["latency_us"] = {key: round(median(run["latency_us"][key] for run in runs), 3) for key in runs[0]["latency_us"]}
+    result["repeats"] = len(runs)
+    result["spread"] = {
+        "operations_per_sec": {"min": ops[0], "max": ops[-1], "relative": round((ops[-1] - ops[0]) / result["operations_per_sec"], 4) if result["operations_per_sec"] else 0.0},
+        "p99_us": {"min": min(run["latency_us"]["p99"] for run in runs), "max": max(run["latency_us"]["p99"] for run in runs)}
+    }
+    return result
+
+
+def scenarios(depths: List[int], threads: List[int]) -> List[dict]:
+    base = {"depth": 1000, "cancels": 1.0, "sizes": "uniform", "symbols": 1, "threads": 1}
+    result = [dict(base, depth=depth) for depth in depths]
+    result += [dict(base, cancels=cancels) for cancels in (0.0, 10.0)]
+    result += [dict(base, sizes=sizes) for sizes in ("fixed", "pareto")]
+    result += [dict(base, symbols=100)]
+    result += [dict(base, threads=n) for n in threads if n != 1]
+    unique = list()
+    for scenario in result:
+        if scenario not in unique:
+            unique.append(scenario)
+    return unique
+
+
+def scenario_name(scenario: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in scenario.items())
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: dict, baseline: dict):  # an ops/s change smaller than the spread of either side is marked as noise
+    base = {result["name"]: result for result in baseline["results"]}
+    print(f"{'scenario':<70} {'ops/s':>12} {'change':>8} {'noise':>7} {'p99 us':>10} {'change':>8}")
+    for result in results["results"]:
+        old = base.get(result["name"])
+        ops, p99 = result["operations_per_sec"], result["latency_us"]["p99"]
+        if old is None:
+            print(f"{result['name']:<70} {ops:>12.0f} {'new':>8} {'':>7} {p99:>10.1f} {'new':>8}")
+            continue
+        ops_change = (ops / old["operations_per_sec"] - 1) * 100 if old["operations_per_sec"] else 0.0
+        p99_change = (p99 / old["latency_us"]["p99"] - 1) * 100 if old["latency_us"]["p99"] else 0.0
+        noise = max(run.get("spread", {}).get("operations_per_sec", {}).get("relative", 0.0) for run in (result, old)) * 100  # baselines without repeats have none
+        flag = " ~" if abs(ops_change) <= noise else ""
+        print(f"{result['name']:<70} {ops:>12.0f} {ops_change:>+7.1f}% {noise:>6.1f}% {p99:>10.1f} {p99_change:>+7.1f}%{flag}")
+
+
+PARSER = argparse.ArgumentParser(description="Benchmark MatchingEngine across book shapes and workloads")
+PARSER.add_argument("-o", "--output", dest="output", default="benchmark.json", help="Results file, json")
+PARSER.add_argument("-b", "--baseline", dest="baseline", default=None, help="Results file of an earlier commit to compare against")
+PARSER.add_argument("-n", "--operations", dest="operations", default=20000, type=int, help="Measured accepts and cancels per scenario")
+PARSER.add_argument("-d", "--depths", dest="depths", default="10,1000,100000,1000000", help="Resting orders before the measurement, delimiter = ','")
+PARSER.add_argument("-t", "--threads", dest="threads", default="1,2,4,8", help="Concurrent submitting threads, delimiter = ','")
+PARSER.add_argument("-u", "--warmup", dest="warmup", default=2000, type=int, help="Untimed accepts and cancels before each measurement")
+PARSER.add_argument("-r", "--repeats", dest="repeats", default=5, type=int, help="Measurements per scenario on a fresh engine, the median is reported")
+PARSER.add_argument("-s", "--seed", dest="seed", default=42, type=int, help="Random seed, the same seed generates the same orders")
+PARSER.add_argument("-w", "--http", dest="http", action="store_true", help="Also measure POST /order end to end against a local order_matching_service")
+PARSER.add_argument("-p", "--port", dest="port", default=9998, type=int, help="Port of the local service started for --http")
+if __name__ == "__main__":
+    ARGUMENTS = PARSER.parse_args()
+    results = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(), "time": time(), "warmup": ARGUMENTS.warmup,
+               "repeats": ARGUMENTS.repeats, "results": list()}
+    for scenario in scenarios([int(depth) for depth in ARGUMENTS.depths.split(",")], [int(n) for n in ARGUMENTS.threads.split(",")]):
+        runs = [bench_engine(**scenario, operations=ARGUMENTS.operations, seed=ARGUMENTS.seed, warmup=ARGUMENTS.warmup) for _ in range(ARGUMENTS.repeats)]
+        result = {"name": scenario_name(scenario), **scenario, **summarize(runs)}
+        results["results"].append(result)
+        print(f"{result['name']}: {result['operations_per_sec']:.0f} ops/s (spread {result['spread']['operations_per_sec']['relative'] * 100:.1f}%), p99 {result['latency_us']['p99']:.1f} us",
+              file=sys.stderr)
+    if ARGUMENTS.http:
+        runs = [bench_http(ARGUMENTS.operations, ARGUMENTS.port, ARGUMENTS.seed, ARGUMENTS.warmup) for _ in range(ARGUMENTS.repeats)]
+        result = {"name": "http=/order", **summarize(runs)}
+        results["results"].append(result)
+        print(f"{result['name']}: {result['operations_per_sec']:.0f} ops/s (spread {result['spread']['operations_per_sec']['relative'] * 100:.1f}%), p99 {result['latency_us']['p99']:.1f} us",
+              file=sys.stderr)
+    with open(ARGUMENTS.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if ARGUMENTS.baseline is not None:
+        with open(ARGUMENTS.baseline) as f:
+            compare(results, json.load(f))
+
+
+"""
+python order_benchmark.py -o before.json
+python order_benchmark.py -o after.json -b before.json
+python order_benchmark.py -d 10,1000 -t 1,4 -n 5000 --http
+python order_benchmark.py -d 1000 -t 1 -r 9 -u 10000  # more repeats and a longer warmup for a noisy machine
+"""
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+from order_matching_engine import EventLog, MatchingEngine, Order, parse_symbols
+from typing import List
+from urllib.parse import parse_qs
+
+
+class MatchingTask:
+    def __init__(self, engine: MatchingEngine, max_batch: int = 1024, max_pending: int = 65536):
+        self.engine = engine
+        self.max_batch = max_batch      # accepts drained together go through engine.accept_orders in one pass
+        self.max_pending = max_pending  # back pressure on the request handlers
+        self.queue = None               # created on the serving loop
+
+    def start(self) -> asyncio.Task:
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        return asyncio.create_task(self.run(), name="matching")
+
+    async def submit(self, method: str, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((method, args, future))
+        return await future
+
+    async def run(self):
+        while True:  # the only caller of the engine, so its book locks are never contended
+            requests = [await self.queue.get()]
+            while len(requests) < self.max_batch and not self.queue.empty():
+                requests.append(self.queue.get_nowait())
+            accepts = list()
+            for method, args, future in requests:
+                if method == "accept_order":
+                    accepts.append((args[0], future))
+                    continue
+                self._accept(accepts)  # keep the arrival order between accepts and other calls
+                accepts = list()
+                try:
+                    result = getattr(self.engine, method)(*args)
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+            self._accept(accepts)
+
+    def _accept(self, accepts: List[tuple]):
+        if not accepts:
+            return
+        futures = {id(order): future for order, future in accepts}
+        try:
+            for order, quantity, trades, error in self.engine.accept_orders([order for order, _ in accepts]):
+                future = futures.pop(id(order))
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result((quantity, trades))
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+engine = MatchingEngine()
+matching = MatchingTask(engine)
+
+
+async def read_body(receive) -> bytes:
+    body, more_body = b"", True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def respond(send, body: str, content_type: str = "text/plain; charset=utf-8", status: int = 200):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type.encode())]})
+    await send({"type": "http.response.body", "body": body.encode()})
+
+
+async def lifespan(receive, send):
+    task = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if not engine.queues:
+                engine.load_symbols(["AAPL", "MSFT"])
+            task = matching.start()
+            engine.start_sweeper()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if task is not None:
+                task.cancel()
+            engine.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    path, method = scope["path"], scope["method"]
+    args = {key: values[0] for key, values in parse_qs(scope["query_string"].decode(), keep_blank_values=True).items()}
+    try:
+        if path == "/order" and method == "GET":
+            size = int(args["size"]) if "size" in args else None
+            view = await matching.submit("view_orders", args.get("symbol"), "include_expired" in args, size)
+            await respond(send, view)
+        elif path == "/order" and method == "POST":
+            order = Order.from_dict(json.loads(await read_body(receive)))
+            quantity, _ = await matching.submit("accept_order", order)
+            await respond(send, f"Posted order: {json.dumps(order.to_dict(quantity))}\n")  # later orders of the same drain may have filled it since
+        elif path == "/order" and method == "PUT":  # cancel-replace
+            order = Order.from_dict(json.loads(await read_body(receive)))
+            old_order, _ = await matching.submit("replace_order", int(args.get("order_id")), order)
+            await respond(send, f"Replaced order: {old_order}\nPosted order: {order}\n")
+        elif path == "/order" and method == "DELETE":
+            order = await matching.submit("cancel_order", int(args.get("order_id")))
+            await respond(send, f"Cancelled order: {order}\n")
+        elif path == "/orders" and method == "POST":
+            body = (await read_body(receive)).decode().strip()
+            batch = [Order.from_dict(data) for data in (json.loads(body) if body.startswith("[") else map(json.loads, filter(None, body.splitlines())))]
+            results = await asyncio.gather(*(matching.submit("accept_order", order) for order in batch), return_exceptions=True)
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson; charset=utf-8")]})
+            for order, result in zip(batch, results):  # NDJSON, one line per order followed by its fills
+                if isinstance(result, Exception):
+                    lines = [{"event": "rejected", "order_id": order.order_id, "error": str(result)}]
+                else:
+                    quantity, trades = result
+                    lines = [{"event": "accepted", "order": order.to_dict(quantity)}] + [{"event": "fill", **trade.to_dict()} for trade in trades]
+                await send({"type": "http.response.body", "body": "".join(json.dumps(line) + "\n" for line in lines).encode(), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        elif path == "/orders" and method == "DELETE":  # mass cancel by account and/or symbol
+            cancelled = await matching.submit("cancel_orders", args.get("account"), args.get("symbol"))
+            await respond(send, "".join(json.dumps(order.to_dict()) + "\n" for order in cancelled), "application/x-ndjson; charset=utf-8")
+        elif path == "/auction" and method == "POST":
+            interval = float(args["interval"]) if "interval" in args else None
+            await matching.submit("start_auction", args.get("symbol"), interval)
+            await respond(send, f"Auction started: {args.get('symbol')}\n")
+        elif path == "/auction" and method in ("PUT", "DELETE"):  # DELETE uncrosses and resumes continuous matching
+            price, trades = await matching.submit("uncross" if method == "PUT" else "end_auction", args.get("symbol"))
+            lines = [{"event": "uncrossed", "symbol": args.get("symbol"), "price": price, "trades": len(trades)}] + [{"event": "fill", **trade.to_dict()} for trade in trades]
+            await respond(send, "".join(json.dumps(line) + "\n" for line in lines), "application/x-ndjson; charset=utf-8")
+        elif path == "/depth" and method == "GET":
+            levels = int(args["levels"]) if "levels" in args else 10
+            if levels < 1:
+                raise ValueError(f"Depth levels must be at least 1, got {levels}")  # answered with a 400 below
+            await respond(send, await matching.submit("view_depth", args.get("symbol"), levels), "application/json; charset=utf-8")
+        elif path == "/metrics" and method == "GET":
+            await respond(send, await matching.submit("view_metrics"), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/history" and method == "GET":
+            since = float(args["since"]) if "since" in args else None  # epoch seconds
+            limit = int(args["limit"]) if "limit" in args else 1000
+            trades, cursor = await matching.submit("query_history", args.get("symbol"), args.get("account"), args.get("cursor"), since, limit)
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson; charset=utf-8"), (b"x-next-cursor", cursor.encode())]})
+            for trade in trades:
+                await send({"type": "http.response.body", "body": (json.dumps(trade.to_dict()) + "\n").encode(), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await respond(send, f"{method} {path} not found\n", status=404)
+    except (KeyError, ValueError) as e:
+        await respond(send, f"{type(e).__name__}: {e}\n", status=400)
+
+
+PARSER = argparse.ArgumentParser(description="Async web host and port")
+PARSER.add_argument("-H", "--host", dest="host", default="localhost", help="Host or IP")
+PARSER.add_argument("-p", "--port", dest="port", default=9999, type=int, help="Port")
+PARSER.add_argument("-s", "--symbols", dest="symbols", default="AAPL,MSFT", help="Trading Symbols with optional tick sizes, e.g. AAPL:0.01,MSFT, delimiter = ','")
+PARSER.add_argument("-l", "--event-log", dest="event_log", default="full", choices=EventLog.LEVELS, help="Order and fill event logging, compact skips full order dumps")
+PARSER.add_argument("-k", "--keep-alive", dest="keep_alive", default=75, type=int, help="Seconds an idle keep-alive connection stays open")
+if __name__ == "__main__":
+    import uvicorn
+    ARGUMENTS = PARSER.parse_args()
+    engine.events.level = EventLog.LEVELS[ARGUMENTS.event_log]
+    engine.load_symbols(*parse_symbols(ARGUMENTS.symbols))
+    uvicorn.run(app, host=ARGUMENTS.host, port=ARGUMENTS.port, timeout_keep_alive=ARGUMENTS.keep_alive, access_log=False)
+
+
+"""
+python order_matching_asgi.py -p 9999 -s AAPL,MSFT
+uvicorn order_matching_asgi:app --port 9999 --timeout-keep-alive 75
+
+curl -X POST http://localhost:9999/order -H 'Content-Type: application/json' -d '{"order_id":"1","symbol":"MSFT","side":"ask","price":200,"quantity":3,"account":"Trader_A","expire_sec":20}'
+curl "http://localhost:9999/order?symbol=MSFT"
+curl "http://localhost:9999/order?symbol=MSFT&include_expired"  # also orders past expiry not evicted by a write yet
+curl -i "http://localhost:9999/history?symbol=MSFT&limit=100"
+"""
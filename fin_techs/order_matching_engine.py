@@ -1,244 +1,1493 @@
+import atexit
 import json
 import logging
-from copy import deepcopy
+import os
+import struct
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime, timedelta
-from ezcode.heap import PriorityMap
+from heapq import heapify, heappop, heappush
+from inspect import isgenerator
+from math import ceil
+from sys import intern
+from multiprocessing import Pipe, Process
 from prettytable import PrettyTable
-from threading import current_thread, Lock
-from time import sleep
-from typing import List
+from queue import SimpleQueue
+from threading import current_thread, Event, Lock, Thread
+from time import monotonic, perf_counter_ns, sleep, time, time_ns
+from typing import Dict, List, Tuple
+try:
+    import numpy as np  # optional, vectorizes the auction clearing price
+except ImportError:
+    np = None
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+DEFAULT_TICK_SIZE = 0.01
+
+
+def parse_symbols(symbols: str) -> Tuple[List[str], Dict[str, float]]:  # "AAPL:0.01,MSFT" -> ([AAPL, MSFT], {AAPL: 0.01})
+    names, tick_sizes = list(), dict()
+    for symbol in symbols.split(","):
+        name, _, tick_size = symbol.partition(":")
+        names.append(name)
+        if tick_size:
+            tick_sizes[name] = float(tick_size)
+    return names, tick_sizes
+
+
+def clearing_price(ask_ticks: List[int], ask_quantities: List[int], bid_ticks: List[int], bid_quantities: List[int]) -> Tuple[int, int]:
+    # price in ticks that executes the most volume, ties go to the smallest imbalance, then to the middle candidate, (None, 0) if nothing crosses
+    if not ask_ticks or not bid_ticks:
+        return None, 0
+    if np is not None:
+        prices = np.unique(np.concatenate((np.asarray(ask_ticks), np.asarray(bid_ticks))))
+        supply = np.zeros(len(prices), dtype=np.int64)
+        demand = np.zeros(len(prices), dtype=np.int64)
+        np.add.at(supply, np.searchsorted(prices, ask_ticks), ask_quantities)
+        np.add.at(demand, np.searchsorted(prices, bid_ticks), bid_quantities)
+        supply = np.cumsum(supply)                   # asks willing to sell at or below each price
+        demand = np.cumsum(demand[::-1])[::-1]       # bids willing to buy at or above each price
+        volume = np.minimum(supply, demand)
+        best = volume.max()
+        if best == 0:
+            return None, 0
+        imbalance = np.where(volume == best, np.abs(demand - supply), np.iinfo(np.int64).max)
+        candidates = np.flatnonzero(imbalance == imbalance.min())
+        return int(prices[candidates[(len(candidates) - 1) // 2]]), int(best)
+    prices = sorted(set(ask_ticks) | set(bid_ticks))
+    asks, bids = defaultdict(int), defaultdict(int)
+    for ticks, quantity in zip(ask_ticks, ask_quantities):
+        asks[ticks] += quantity
+    for ticks, quantity in zip(bid_ticks, bid_quantities):
+        bids[ticks] += quantity
+    supply, total = list(), 0
+    for price in prices:
+        total += asks[price]
+        supply.append(total)
+    demand, total = [0] * len(prices), 0
+    for i in range(len(prices) - 1, -1, -1):
+        total += bids[prices[i]]
+        demand[i] = total
+    ranked = [(min(supply[i], demand[i]), -abs(demand[i] - supply[i]), i) for i in range(len(prices))]
+    best = max(ranked)[:2]
+    if best[0] == 0:
+        return None, 0
+    candidates = [i for volume, imbalance, i in ranked if (volume, imbalance) == best]
+    return prices[candidates[(len(candidates) - 1) // 2]], best[0]
+
 
 class Order:
-    def __init__(self, order_id: int, symbol: str, side: str, price: float, quantity: int, account: str, expire_sec: int):
+    __slots__ = ("order_id", "symbol", "side", "price", "ticks", "quantity", "account", "created_ns", "expire_sec", "expire_at")
+
+    def __init__(self, order_id: int, symbol: str, side: str, price: float, quantity: int, account: str, expire_sec: int, now: float = None):
         self.order_id = order_id
-        self.symbol = symbol
-        self.side = side
+        self.symbol = intern(symbol)  # every order of a symbol, account or side points at one shared string
+        self.side = intern(side)
         self.price = price
+        self.ticks = None  # integer price in ticks of the symbol, set by the engine and used for all book comparisons
         self.quantity = quantity
-        self.account = account
-        self.time = datetime.now()
+        self.account = intern(account)
+        self.created_ns = time_ns()  # epoch nanoseconds, an int instead of a datetime per order
         self.expire_sec = expire_sec
+        self.expire_at = (monotonic() if now is None else now) + expire_sec  # wall clock jumps must not expire orders
+
+    @property
+    def time(self) -> datetime:
+        return datetime.fromtimestamp(self.created_ns / 1e9)
 
     def __str__(self):
         return "{" + f"\"order_id\": {self.order_id}, \"symbol\": \"{self.symbol}\", \"side\": \"{self.side}\", \"price\": {self.price}, " +\
                      f"\"quantity\": {self.quantity}, \"account\": \"{self.account}\", \"time\": \"{self.time}\", \"expire_sec\": {self.expire_sec}" + "}"
 
-    def check_type(self, other):
-        if not isinstance(other, type(self)): 
-            raise NotImplementedError(f"{other} is not type {type(self)}")
+    def time_left(self, now: float = None) -> str:
+        tl = timedelta(seconds=max(self.expire_at - (monotonic() if now is None else now), 0))
+        return str(tl).split(".")[0]  # remove microseconds
 
-    def __gt__(self, other):
-        self.check_type(other)
-        # return other < self
-        if self.price > other.price:
-            return True
-        if other.price > self.price:
-            return False
-        if self.time < other.time:    # Max Heap should always put earlier order on top
-            return True
-        if other.time < self.time:    # Max Heap should always put earlier order on top
+    def is_valid(self, now: float = None) -> bool:
+        return self.expire_at >= (monotonic() if now is None else now)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(int(data["order_id"]), data["symbol"], data["side"], data["price"], data["quantity"], data["account"], data["expire_sec"])
+
+    def to_dict(self, quantity: int = None) -> dict:
+        return {
+            "order_id": self.order_id, "symbol": self.symbol, "side": self.side, "price": self.price,
+            "quantity": self.quantity if quantity is None else quantity, "account": self.account, "time": str(self.time), "expire_sec": self.expire_sec
+        }
+
+
+class TradeRecord:
+    __slots__ = ("trade_id", "accepted_order", "matched_order", "accepted_quantity", "matched_quantity", "quantity_filled", "time", "price")
+
+    def __init__(self, accepted_order: Order, matched_order: Order, accepted_quantity: int, matched_quantity: int, quantity_filled: int, time: float,
+                 price: float = None):
+        self.trade_id = None                      # assigned by TradeHistory, doubles as the pagination cursor
+        self.accepted_order = accepted_order      # orders are referenced, not copied, only quantity changes after a fill
+        self.matched_order = matched_order
+        self.accepted_quantity = accepted_quantity  # quantities before the fill
+        self.matched_quantity = matched_quantity
+        self.quantity_filled = quantity_filled
+        self.time = time
+        self.price = price  # auction clearing price, continuous trades execute at the matched order's price
+
+    @property
+    def final_price(self) -> float:
+        return self.matched_order.price if self.price is None else self.price
+
+    def __str__(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "trade_id": self.trade_id,
+            "accepted_order": self.accepted_order.to_dict(self.accepted_quantity),
+            "matched_order": self.matched_order.to_dict(self.matched_quantity),
+            "quantity_filled": self.quantity_filled,
+            "final_price": self.final_price,
+            "price_gap": abs(self.accepted_order.price - self.matched_order.price),
+            "time": datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S.%f")
+        }
+
+
+class TradeIndex:
+    __slots__ = ("trade_ids", "start")
+
+    def __init__(self):
+        self.trade_ids = list()  # ascending, ids below start were overwritten in the ring
+        self.start = 0
+
+    def __len__(self):
+        return len(self.trade_ids) - self.start
+
+    def append(self, trade_id: int):
+        self.trade_ids.append(trade_id)
+
+    def trim(self, first_trade_id: int):
+        while self.start < len(self.trade_ids) and self.trade_ids[self.start] < first_trade_id:
+            self.start += 1
+        if self.start > 1024 and self.start * 2 > len(self.trade_ids):  # compact once the dead prefix dominates
+            self.trade_ids = self.trade_ids[self.start:]  # a new list, readers still walking the old one see it unchanged
+            self.start = 0
+
+    def after(self, cursor: int):  # lock free, appends only grow the list and compaction swaps it
+        trade_ids = self.trade_ids
+        i = bisect_left(trade_ids, cursor)
+        while i < len(trade_ids):
+            yield trade_ids[i]
+            i += 1
+
+
+class TradeHistory:
+    def __init__(self, capacity: int = 100000, spill_path: str = None):
+        self.capacity = capacity
+        self.records = [None] * capacity  # ring buffer, trade_id % capacity, overwritten records are spilled to disk as json lines
+        self.size = 0
+        self.total = 0  # trades ever appended, spilled ones included, the next trade_id
+        self.symbol_index = dict()   # {symbol: TradeIndex}
+        self.account_index = dict()  # {account: TradeIndex}
+        self.spill_path = spill_path
+        self.spill_queue = SimpleQueue()  # evicted records, formatted and written by the spill thread so matching never waits on the disk
+        self.spill_writer = None
+        if spill_path is not None:
+            self.spill_writer = Thread(target=self._spill, name="trade-spill", daemon=True)
+            self.spill_writer.start()
+            atexit.register(self.close)
+        self.lock = Lock()  # writers only, symbols match concurrently, readers never take it
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return self.tail(0)
+
+    def tail(self, cursor: int):  # lock free, the records published when the read started
+        end = self.total  # a record is in its slot before total covers it
+        for trade_id in range(max(cursor, end - self.capacity, 0), end):
+            record = self.records[trade_id % self.capacity]
+            if record.trade_id == trade_id:  # otherwise overwritten by a newer trade since the read started
+                yield record
+
+    def __getstate__(self):  # a copy for reading, only the original spills, so no writer thread or spill file in the receiving process
+        return {"capacity": self.capacity, "records": list(self)}
+
+    def __setstate__(self, state):
+        self.__init__(state["capacity"])
+        for record in state["records"]:
+            self.append(record)
+
+    @staticmethod
+    def _keys(record: TradeRecord):
+        accounts = {record.accepted_order.account, record.matched_order.account}
+        return record.accepted_order.symbol, accounts
+
+    def append(self, record: TradeRecord):
+        with self.lock:
+            record.trade_id = self.total
+            position = self.total % self.capacity
+            if self.size < self.capacity:
+                self.size += 1
+            else:
+                evicted = self.records[position]
+                if self.spill_writer is not None:
+                    self.spill_queue.put(evicted)
+                symbol, accounts = self._keys(evicted)
+                for index, key in [(self.symbol_index, symbol)] + [(self.account_index, account) for account in accounts]:
+                    index[key].trim(evicted.trade_id + 1)
+                    if not index[key]:
+                        del index[key]
+            self.records[position] = record
+            symbol, accounts = self._keys(record)
+            self.symbol_index.setdefault(symbol, TradeIndex()).append(record.trade_id)
+            for account in accounts:
+                self.account_index.setdefault(account, TradeIndex()).append(record.trade_id)
+            self.total += 1  # publishes the record to readers
+
+    def _first_since(self, since: float, low: int, high: int) -> int:
+        while low < high:  # trade ids are appended in time order
+            middle = (low + high) // 2
+            if self.records[middle % self.capacity].time < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, symbol: str = None, account: str = None, cursor: int = 0, since: float = None, limit: int = 100) -> Tuple[List[TradeRecord], int]:
+        records = list()
+        end = self.total  # lock free, the page is cut at the trades published when the read started
+        start = max(cursor, end - self.capacity, 0)  # spilled trades are not served
+        if since is not None:
+            start = self._first_since(since, start, end)
+        if account is not None or symbol is not None:
+            index = self.account_index.get(account) if account is not None else self.symbol_index.get(symbol)
+            trade_ids = index.after(start) if index is not None else iter(())
+        else:
+            trade_ids = range(start, end)
+        for trade_id in trade_ids:
+            if trade_id >= end:
+                break
+            record = self.records[trade_id % self.capacity]
+            if record.trade_id != trade_id:  # evicted while reading, spilled trades are not served
+                continue
+            if symbol is not None and record.accepted_order.symbol != symbol:
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                return records, record.trade_id + 1
+        return records, end
+
+    def _spill(self):
+        with open(self.spill_path, "a") as f:
+            while True:
+                record = self.spill_queue.get()
+                if record is None:
+                    return
+                try:
+                    f.write(str(record) + "\n")
+                except Exception:
+                    logger.exception("Trade history failed to spill trade %s", record.trade_id)
+                if self.spill_queue.empty():  # flush once the backlog is written, not per record
+                    f.flush()
+
+    def close(self):  # writes out the queued records and closes the spill file
+        if self.spill_writer is not None and self.spill_writer.is_alive():
+            self.spill_queue.put(None)
+            self.spill_writer.join()
+
+
+class TimerWheel:
+    def __init__(self, tick_sec: float = 0.1, slots: int = 64, levels: int = 4, now: float = None):
+        self.tick_sec = tick_sec
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[dict() for _ in range(slots)] for _ in range(levels)]  # level 0 = one tick per slot, level n = slots^n ticks per slot
+        self.timers = dict()  # {order_id: slot dict holding the order}
+        self.tick = int((monotonic() if now is None else now) / tick_sec)  # last tick fired
+
+    def __len__(self):
+        return len(self.timers)
+
+    def _schedule(self, order) -> bool:
+        expire_tick = ceil(order.expire_at / self.tick_sec)  # never evict before expire_at
+        delta = expire_tick - self.tick
+        if delta <= 0:
             return False
-        return self.quantity > other.quantity
+        level, span = 0, self.slots
+        while delta >= span and level < self.levels - 1:
+            level, span = level + 1, span * self.slots
+        expire_tick = min(expire_tick, self.tick + span - 1)  # beyond the top wheel, park in its farthest slot and cascade again later
+        slot = self.wheels[level][(expire_tick // (span // self.slots)) % self.slots]
+        slot[order.order_id] = order
+        self.timers[order.order_id] = slot
+        return True
 
-    def __lt__(self, other):
-        self.check_type(other)
-        if self.price < other.price:
-            return True
-        if other.price < self.price:
+    def add(self, order) -> bool:
+        self.remove(order.order_id)
+        return self._schedule(order)
+
+    def remove(self, order_id: int):
+        slot = self.timers.pop(order_id, None)
+        if slot is not None:
+            del slot[order_id]
+
+    def _next_tick(self, target_tick: int) -> int:  # the first tick with a slot to fire or an upper slot to cascade, target_tick if none comes before it
+        best = target_tick
+        for offset in range(1, min(self.slots, best - self.tick)):
+            if self.wheels[0][(self.tick + offset) % self.slots]:
+                best = self.tick + offset
+                break
+        span = self.slots
+        for level in range(1, self.levels):  # the next slots boundaries of each upper wheel, only those before the best tick so far
+            boundary = (self.tick // span + 1) * span
+            for _ in range(self.slots):
+                if boundary >= best:
+                    break
+                if self.wheels[level][(boundary // span) % self.slots]:
+                    best = boundary
+                    break
+                boundary += span
+            span *= self.slots
+        return best
+
+    def due(self, now: float) -> bool:  # whether advance(now) has a slot to fire or cascade, safe to call without the lock as a hint
+        target_tick = int(now / self.tick_sec)
+        if target_tick <= self.tick or not self.timers:
             return False
-        if self.time < other.time:
+        if self._next_tick(target_tick) < target_tick or self.wheels[0][target_tick % self.slots]:
             return True
-        if other.time < self.time:
-            return False
-        return self.quantity < other.quantity
+        span = self.slots
+        for level in range(1, self.levels):
+            if target_tick % span != 0:
+                break
+            if self.wheels[level][(target_tick // span) % self.slots]:
+                return True
+            span *= self.slots
+        return False
 
-    def time_left(self) -> str:
-        tl = self.time + timedelta(seconds=self.expire_sec) - datetime.now() if self.is_valid() else timedelta(seconds=0)
-        return str(tl).split(".")[0]  # remove microseconds
+    def advance(self, now: float) -> List[Order]:
+        expired = list()
+        target_tick = int(now / self.tick_sec)
+        if not self.timers:
+            self.tick = max(self.tick, target_tick)
+            return expired
+        while self.tick < target_tick:
+            self.tick = self._next_tick(target_tick)  # the ticks skipped have nothing to fire or cascade, an idle gap costs one jump
+            span = self.slots
+            for level in range(1, self.levels):  # cascade the upper wheels whose slot boundary was just crossed
+                if self.tick % span != 0:
+                    break
+                slot = self.wheels[level][(self.tick // span) % self.slots]
+                orders = list(slot.values())
+                slot.clear()
+                for order in orders:
+                    del self.timers[order.order_id]
+                    if not self._schedule(order):
+                        expired.append(order)
+                span *= self.slots
+            slot = self.wheels[0][self.tick % self.slots]
+            orders = list(slot.values())
+            slot.clear()
+            for order in orders:
+                del self.timers[order.order_id]
+                if not self._schedule(order):
+                    expired.append(order)
+        return expired
+
+
+class LatencyHistogram:
+    def __init__(self, precision: int = 7):
+        self.precision = precision  # values share a bucket when equal in the top precision + 1 bits, < 1% error at 7
+        self.counts = dict()        # {(shift, value >> shift): count}, memory is bounded by the value range, not the sample size
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value: int):
+        shift = max(value.bit_length() - self.precision - 1, 0)
+        bucket = (shift, value >> shift)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def copy(self):
+        histogram = LatencyHistogram(self.precision)
+        histogram.counts, histogram.total, histogram.sum, histogram.max = dict(self.counts), self.total, self.sum, self.max
+        return histogram
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentiles(self, percents: List[float]) -> List[int]:
+        results, count, value, buckets = list(), 0, 0, iter(sorted(self.counts.items(), key=lambda item: item[0][1] << item[0][0]))
+        for percent in sorted(percents):
+            rank = percent / 100 * self.total
+            while count < rank:
+                (shift, mantissa), bucket_count = next(buckets)
+                count += bucket_count
+                value = min(((mantissa << shift) + (mantissa + 1 << shift)) // 2, self.max)  # bucket midpoint
+            results.append(value if self.total else 0)
+        return results
+
+
+class SymbolMetrics:
+    EVENTS = ("accepts", "fills", "cancels", "expiries")
+    STAGES = ("log", "lock_wait", "match", "accept")  # accept = end to end
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.EVENTS, 0)
+        self.latency = {stage: LatencyHistogram() for stage in self.STAGES}  # nanoseconds
+        self.lock = Lock()  # both book sides of a symbol record here, held for a few dict updates
+
+    def count(self, event: str, n: int = 1):
+        with self.lock:
+            self.counters[event] += n
+
+    def record_accept(self, log_ns: int, lock_wait_ns: int, match_ns: int, accept_ns: int, fills: int):  # None = stage not timed for this order
+        with self.lock:
+            self.counters["accepts"] += 1
+            self.counters["fills"] += fills
+            for stage, value in zip(self.STAGES, (log_ns, lock_wait_ns, match_ns, accept_ns)):
+                if value is not None:
+                    self.latency[stage].record(value)
+
+    def collect(self) -> Tuple[dict, dict]:
+        with self.lock:
+            return dict(self.counters), {stage: histogram.copy() for stage, histogram in self.latency.items()}
+
+
+class EventLog:
+    OFF, COMPACT, FULL = 0, 1, 2  # FULL dumps whole orders and trades, COMPACT only ids, prices and quantities
+    LEVELS = {"off": OFF, "compact": COMPACT, "full": FULL}
+
+    def __init__(self, logger=logger, level: int = FULL):
+        self.logger = logger
+        self.level = level
+        self.queue = SimpleQueue()  # event tuples, formatted and written by the writer thread only
+        self.writer = Thread(target=self._write, name="event-log", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def order(self, action: str, order: Order):  # a tuple and a queue put, safe under a book lock
+        if self.level:
+            self.queue.put((self._format_order, current_thread(), action, order, order.quantity))  # only quantity changes later
+
+    def trade(self, trade: TradeRecord):
+        if self.level:
+            self.queue.put((self._format_trade, trade))
+
+    def message(self, message: str, *args):  # %-style, formatted by the writer thread
+        if self.level:
+            self.queue.put((self._format_message, current_thread(), message, args))
+
+    def _format_order(self, thread, action: str, order: Order, quantity: int) -> str:
+        if self.level == self.COMPACT:
+            return f"[{thread.name} {thread.native_id}] {action} Order {order.order_id}: {order.symbol} {order.side} {quantity}@{order.price}"
+        return f"[{thread.name} {thread.native_id}] {action} Order: {json.dumps(order.to_dict(quantity))}"
+
+    def _format_trade(self, trade: TradeRecord) -> str:
+        if self.level == self.COMPACT:
+            return f"Matched Orders {trade.trade_id}: {trade.accepted_order.order_id} x {trade.matched_order.order_id} {trade.quantity_filled}@{trade.final_price}"
+        return f"Matched Orders: {trade}"
+
+    def _format_message(self, thread, message: str, args: tuple) -> str:
+        return f"[{thread.name} {thread.native_id}] " + (message % args if args else message)
+
+    def _write(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                self.logger.info(event[0](*event[1:]))
+            except Exception:
+                self.logger.exception("Event log failed to write an event")
+
+    def close(self):  # writes out the queued events
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+
+class PriceLevel(OrderedDict):  # FIFO queue {order_id: order} with the total resting quantity
+    def __init__(self, ticks: int, price: float):
+        super().__init__()
+        self.reset(ticks, price)
+
+    def reset(self, ticks: int, price: float):
+        self.ticks = ticks
+        self.price = price  # as submitted, for display
+        self.quantity = 0
+
+
+class OrderBookSide:
+    def __init__(self, side: str):
+        self.side = side
+        self.sign = 1 if side == "bid" else -1  # sort key = sign * ticks, the best price is always the last key
+        self.keys = list()    # sorted int keys, bisect on insert, pop from the end when a level is emptied
+        self.levels = dict()  # {ticks: PriceLevel}, O(1) level lookup by tick
+        self.size = 0         # resting orders, the engine's db is the only order id index
+        self.accounts = dict()  # {account: {order_id: order}}, resting orders per account
+        self.version = 0      # bumped on every change, depth caches compare against it
+        self.free_levels = list()  # emptied PriceLevels, reused as the touch moves instead of allocating new ones
+
+    def _free_level(self, ticks: int):
+        level = self.levels.pop(ticks)
+        if len(self.free_levels) < 1024:
+            self.free_levels.append(level)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, order: Order):  # still resting, found through its own price level
+        level = self.levels.get(order.ticks)
+        return level is not None and level.get(order.order_id) is order
+
+    def __iter__(self):  # best price first, time priority within a level
+        for key in reversed(self.keys):
+            yield from self.levels[self.sign * key].values()
+
+    def push(self, order: Order):
+        level = self.levels.get(order.ticks)
+        if level is None:
+            key = self.sign * order.ticks
+            self.keys.insert(bisect_left(self.keys, key), key)
+            if self.free_levels:
+                level = self.free_levels.pop()
+                level.reset(order.ticks, order.price)
+            else:
+                level = PriceLevel(order.ticks, order.price)
+            self.levels[order.ticks] = level
+        level[order.order_id] = order
+        level.quantity += order.quantity
+        self.size += 1
+        self.accounts.setdefault(order.account, dict())[order.order_id] = order
+        self.version += 1
+
+    def peek(self) -> Order:
+        if not self.keys:
+            raise IndexError(f"Empty {self.side} book")
+        return next(iter(self.levels[self.sign * self.keys[-1]].values()))
+
+    def pop(self) -> Order:
+        if not self.keys:
+            raise IndexError(f"Empty {self.side} book")
+        ticks = self.sign * self.keys[-1]
+        level = self.levels[ticks]
+        _, order = level.popitem(last=False)
+        level.quantity -= order.quantity
+        if not level:
+            self.keys.pop()
+            self._free_level(ticks)
+        self.size -= 1
+        self._unindex_account(order)
+        self.version += 1
+        return order
+
+    def _unindex_account(self, order: Order):
+        orders = self.accounts[order.account]
+        del orders[order.order_id]
+        if not orders:
+            del self.accounts[order.account]
+
+    def reduce(self, order: Order, quantity: int):
+        order.quantity -= quantity  # partial fill in place, the order keeps its time priority
+        self.levels[order.ticks].quantity -= quantity
+        self.version += 1
 
-    def is_valid(self) -> bool:
-        return self.time + timedelta(seconds=self.expire_sec) >= datetime.now()
+    def delete(self, order: Order) -> Order:
+        if order not in self:
+            raise KeyError(f"Order ID \"{order.order_id}\" not found in {self.side} book")
+        level = self.levels[order.ticks]
+        del level[order.order_id]
+        self.size -= 1
+        level.quantity -= order.quantity
+        if not level:
+            key = self.sign * order.ticks
+            del self.keys[bisect_left(self.keys, key)]
+            self._free_level(order.ticks)
+        self._unindex_account(order)
+        self.version += 1
+        return order
+
+    def top_n(self, size: int = None, now: float = None) -> List[Tuple[Order, int]]:  # (order, quantity) copies, only quantity changes in place
+        orders = list()
+        for key in reversed(self.keys):
+            for order in self.levels[self.sign * key].values():
+                if size is not None and len(orders) >= size:
+                    return orders
+                if now is None or order.expire_at >= now:  # expired orders not evicted yet are skipped, not counted
+                    orders.append((order, order.quantity))
+        return orders
+
+    def depth(self, levels: int = None) -> List[dict]:  # from the level totals, O(levels) however many orders rest in them
+        rows = list()
+        for key in reversed(self.keys):
+            if levels is not None and len(rows) >= levels:
+                break
+            level = self.levels[self.sign * key]
+            rows.append({"price": level.price, "quantity": level.quantity, "orders": len(level)})
+        return rows
+
+
+class BookLock:  # the symbol lock, its sequence is odd while a writer holds it so readers can copy the book without taking it
+    def __init__(self):
+        self.lock = Lock()
+        self.sequence = 0
+
+    def acquire(self):
+        self.lock.acquire()
+        self.sequence += 1
+
+    def release(self):
+        self.sequence += 1
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class Journal:
+    ACCEPT, CANCEL, FILL = 1, 2, 3
+    FRAME = struct.Struct("<II")                 # body length, crc32 of body
+    ACCEPT_RECORD = struct.Struct("<BqBdqdd")    # type, order_id, side, price, quantity, created epoch, expire_sec + symbol, account
+    CANCEL_RECORD = struct.Struct("<Bq")         # type, order_id
+    FILL_RECORD = struct.Struct("<Bqqqd")        # type, accepted order_id, matched order_id, quantity_filled, epoch
+    SIDES = {"ask": 0, "bid": 1}
+
+    def __init__(self, directory: str, commit_interval: float = 0.002, snapshot_interval: float = None):
+        self.directory = directory
+        self.commit_interval = commit_interval    # group commit: one write + fsync per interval for every record appended meanwhile
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+        segments = self.list_files("journal")
+        self.segment = segments[-1] + 1 if segments else 0  # never append to a segment that may have a torn tail
+        self.file = open(self.path("journal", self.segment), "ab")
+        self.buffer = bytearray()
+        self.lock = Lock()         # guards buffer, held for a memcpy per record
+        self.commit_lock = Lock()  # guards file
+        self.closing = Event()
+        self.committer = Thread(target=self._commit_loop, name="journal-commit", daemon=True)
+        self.committer.start()
+
+    def path(self, kind: str, segment: int) -> str:
+        return os.path.join(self.directory, f"{kind}.{segment:08d}")
+
+    def list_files(self, kind: str) -> List[int]:
+        return sorted(int(name.split(".")[1]) for name in os.listdir(self.directory) if name.startswith(kind + ".") and name.split(".")[1].isdigit())
+
+    @classmethod
+    def frame(cls, body: bytes) -> bytes:
+        return cls.FRAME.pack(len(body), zlib.crc32(body)) + body
+
+    @classmethod
+    def encode_accept(cls, order: Order, quantity: int) -> bytes:
+        symbol, account = order.symbol.encode(), order.account.encode()
+        return cls.frame(
+            cls.ACCEPT_RECORD.pack(cls.ACCEPT, order.order_id, cls.SIDES[order.side], order.price, quantity, order.created_ns / 1e9, order.expire_sec) +
+            bytes((len(symbol),)) + symbol + bytes((len(account),)) + account
+        )
+
+    @classmethod
+    def decode(cls, data: bytes):
+        view, offset = memoryview(data), 0
+        while offset + cls.FRAME.size <= len(view):
+            length, crc = cls.FRAME.unpack_from(view, offset)
+            body = view[offset + cls.FRAME.size: offset + cls.FRAME.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                return  # torn tail of the last write before a crash
+            offset += cls.FRAME.size + length
+            if body[0] == cls.ACCEPT:
+                record = cls.ACCEPT_RECORD.unpack_from(body)
+                symbol_end = cls.ACCEPT_RECORD.size + 1 + body[cls.ACCEPT_RECORD.size]
+                symbol = bytes(body[cls.ACCEPT_RECORD.size + 1: symbol_end]).decode()
+                account = bytes(body[symbol_end + 1: symbol_end + 1 + body[symbol_end]]).decode()
+                yield record + (symbol, account)
+            elif body[0] == cls.CANCEL:
+                yield cls.CANCEL_RECORD.unpack_from(body)
+            elif body[0] == cls.FILL:
+                yield cls.FILL_RECORD.unpack_from(body)
+
+    def _append(self, record: bytes):
+        with self.lock:
+            self.buffer += record
+
+    def accept(self, order: Order):
+        self._append(self.encode_accept(order, order.quantity))
+
+    def cancel(self, order_id: int):
+        self._append(self.frame(self.CANCEL_RECORD.pack(self.CANCEL, order_id)))
+
+    def fill(self, trade: TradeRecord):
+        self._append(self.frame(self.FILL_RECORD.pack(self.FILL, trade.accepted_order.order_id, trade.matched_order.order_id, trade.quantity_filled, trade.time)))
+
+    def _commit(self):
+        with self.lock:
+            buffer, self.buffer = self.buffer, bytearray()
+        if buffer:
+            self.file.write(buffer)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def commit(self):
+        with self.commit_lock:
+            self._commit()
+
+    def _commit_loop(self):
+        while not self.closing.wait(self.commit_interval):
+            self.commit()
+
+    def roll(self) -> int:
+        with self.commit_lock:
+            self._commit()
+            self.file.close()
+            self.segment += 1
+            self.file = open(self.path("journal", self.segment), "ab")
+        return self.segment
+
+    def write_snapshot(self, segment: int, orders: list):
+        temp_path = self.path("snapshot", segment) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(b"".join(self.encode_accept(order, quantity) for order, quantity in orders))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path("snapshot", segment))  # a snapshot is either complete or absent
+        for old_segment in self.list_files("journal"):
+            if old_segment < segment:
+                os.remove(self.path("journal", old_segment))
+        for old_segment in self.list_files("snapshot"):
+            if old_segment < segment:
+                os.remove(self.path("snapshot", old_segment))
+
+    def read(self):
+        snapshots = self.list_files("snapshot")
+        start = snapshots[-1] if snapshots else 0
+        if snapshots:
+            with open(self.path("snapshot", start), "rb") as f:
+                yield from self.decode(f.read())
+        for segment in self.list_files("journal"):
+            if segment >= start:
+                with open(self.path("journal", segment), "rb") as f:
+                    yield from self.decode(f.read())
+
+    def close(self):
+        self.closing.set()
+        self.committer.join()
+        self.commit()
+        self.file.close()
 
 
 class MatchingEngine:
-    def __init__(self, logger=logger):
+    CACHED_SIZES = (None, 10, 20, 50, 100)  # view sizes and depth levels worth caching, others are copied per request so clients cannot grow the caches
+    CACHED_LEVELS = (1, 5, 10, 20, 50, 100)
+
+    def __init__(self, logger=logger, history_capacity: int = 100000, history_spill_path: str = None, journal: Journal = None, clock=monotonic,
+                 event_level: int = EventLog.FULL):
         self.logger = logger
-        self.history = list()
-        self.queues = dict()  # {symbol: {ask: min_q, bid: max_q}}
-        self.locks = dict()   # {symbol: {ask: lock, bid: lock}}
+        self.events = EventLog(logger, event_level)  # order and fill events, never formatted or written on the matching path
+        self.clock = clock  # monotonic seconds, replaced by a simulated clock in replays
+        self.history = TradeHistory(history_capacity, history_spill_path)
+        self.journal = journal
+        self.queues = dict()  # {symbol: {ask: OrderBookSide, bid: OrderBookSide}}
+        self.locks = dict()   # {symbol: BookLock}, one critical section for both sides of a book and its timers, symbols never wait on each other
+        self.pending = dict()  # {symbol: deque of [order, trades, error]}, accepts waiting for the symbol lock, drained together
+        self.tick_sizes = dict()  # {symbol: tick_size}
         self.db = dict()      # mimic the order database {order_id: order}
+        self.timers = dict()  # {symbol: TimerWheel}, resting orders by expiry, guarded by the symbol lock
+        self.depth_cache = dict()   # {(symbol, levels): (ask version, bid version, depth json)}, CACHED_LEVELS only
+        self.order_views = dict()   # {(symbol, size, include_expired): (lock sequence, valid until, ask rows, bid rows)}, CACHED_SIZES only,
+                                    # shared by readers until the book changes or one of its orders expires
+        self.metrics = dict()       # {symbol: SymbolMetrics}, recorded in `if __debug__` blocks that python -O compiles out
+        self.auctions = dict()      # {symbol: Event set when the auction ends}, orders of these symbols rest without matching until uncrossed
+        self.listeners = list()     # objects with trade(trade) and removed(order_id), told of every trade and of every order cancelled or expired,
+                                    # called under the symbol lock like the event log, so they must not block
+        self.closing = Event()      # stops the expiry sweeper
+        if journal is not None and journal.snapshot_interval is not None:
+            Thread(target=self._snapshot_loop, name="snapshot", daemon=True).start()
 
-    def load_symbols(self, symbols: List[str]):
+    def load_symbols(self, symbols: List[str], tick_sizes: Dict[str, float] = None):
         for symbol in symbols:
             if symbol not in self.queues:
                 self.queues[symbol] = dict()
-                self.locks[symbol] = dict()
-            self.queues[symbol]["ask"] = PriorityMap(min_heap=True)
-            self.queues[symbol]["bid"] = PriorityMap(min_heap=False)
-            self.locks[symbol]["ask"] = Lock()
-            self.locks[symbol]["bid"] = Lock()
+                self.locks[symbol] = BookLock()
+                self.pending[symbol] = deque()
+            self.tick_sizes[symbol] = tick_sizes.get(symbol, DEFAULT_TICK_SIZE) if tick_sizes else DEFAULT_TICK_SIZE
+            self.metrics[symbol] = SymbolMetrics()
+            self.timers[symbol] = TimerWheel(now=self.clock())
+            self.queues[symbol]["ask"] = OrderBookSide("ask")
+            self.queues[symbol]["bid"] = OrderBookSide("bid")
 
-    def view_history(self):
+    def to_ticks(self, order: Order) -> int:
+        if order.symbol not in self.tick_sizes:
+            raise ValueError(f"Symbol \"{order.symbol}\" not loaded")
+        tick_size = self.tick_sizes[order.symbol]
+        ticks = round(order.price / tick_size)
+        if abs(ticks * tick_size - order.price) > tick_size * 1e-6:
+            raise ValueError(f"Price {order.price} is not a multiple of the {order.symbol} tick size {tick_size}")
+        return ticks
+
+    def snapshot(self):
+        locks = [self.locks[symbol] for symbol in sorted(self.locks)]
+        for lock in locks:  # every journaled accept is in db and no match is in flight
+            lock.acquire()
+        try:
+            segment = self.journal.roll()
+            orders = [(order, order.quantity) for order in list(self.db.values()) if order.quantity > 0]
+        finally:
+            for lock in locks:
+                lock.release()
+        self.journal.write_snapshot(segment, orders)  # encoded and written outside the locks
+        self.logger.info(f"Snapshot {segment}: {len(orders)} orders")
+
+    def _snapshot_loop(self):
+        while not self.journal.closing.wait(self.journal.snapshot_interval):
+            self.snapshot()
+
+    def recover(self):
+        now, epoch = self.clock(), time()
+        orders = OrderedDict()  # {order_id: order} in accept order
+        trades = 0
+        for record in self.journal.read():
+            if record[0] == Journal.ACCEPT:
+                _, order_id, side, price, quantity, created, expire_sec, symbol, account = record
+                order = Order(order_id, symbol, "bid" if side else "ask", price, quantity, account, expire_sec)
+                order.created_ns = int(created * 1e9)
+                order.expire_at = now + created + expire_sec - epoch
+                orders[order_id] = order
+            elif record[0] == Journal.CANCEL:
+                orders.pop(record[1], None)
+            elif record[0] == Journal.FILL:
+                _, accepted_id, matched_id, quantity_filled, trade_time = record
+                if accepted_id in orders and matched_id in orders:
+                    accepted_order, matched_order = orders[accepted_id], orders[matched_id]
+                    self.history.append(TradeRecord(accepted_order, matched_order, accepted_order.quantity, matched_order.quantity, quantity_filled, trade_time))
+                    accepted_order.quantity -= quantity_filled
+                    matched_order.quantity -= quantity_filled
+                    trades += 1
+        self.load_symbols({order.symbol for order in orders.values()} - set(self.queues))
+        for order in orders.values():
+            if order.quantity > 0 and order.is_valid(now):
+                order.ticks = self.to_ticks(order)
+                self.db[order.order_id] = order
+                self.queues[order.symbol][order.side].push(order)
+                self.timers[order.symbol].add(order)
+        self.logger.info(f"Recovered {len(self.db)} orders and {trades} trades from {self.journal.directory}")
+
+    @staticmethod
+    def format_history(history: List[TradeRecord]) -> str:
         history_str = ""
-        for match_result in self.history:
-            history_str += json.dumps(match_result, indent=4) + "\n"
+        for trade in history:
+            history_str += json.dumps(trade.to_dict(), indent=4) + "\n"
         return history_str if history_str else "No Transaction Found!\n"
 
-    def _match(self, order, queue):
+    def view_history(self):
+        return self.format_history(self.history)
+
+    def query_history(self, symbol: str = None, account: str = None, cursor: str = None, since: float = None, limit: int = 100) -> Tuple[List[TradeRecord], str]:
+        records, next_cursor = self.history.query(symbol, account, int(cursor) if cursor else 0, since, limit)
+        return records, str(next_cursor)
+
+    def expire_orders(self, now: float = None):  # one pass of the sweeper, for symbols that see no writes, which evict their own expired orders
+        now = self.clock() if now is None else now
+        for symbol in list(self.queues):
+            if self.timers[symbol].due(now):  # a symbol with nothing due is not locked, its readers' caches stay valid
+                with self.locks[symbol]:
+                    self._expire_locked(symbol, now)
+
+    def start_sweeper(self, interval: float = 0.1):  # every timer wheel tick by default, quiet symbols and /metrics see expiries within a tick
+        Thread(target=self._sweep_loop, args=(interval,), name="expiry-sweeper", daemon=True).start()
+
+    def _sweep_loop(self, interval: float):
+        while not self.closing.wait(interval):
+            self.expire_orders()
+
+    def _expire_locked(self, symbol: str, now: float):  # the symbol lock is held
+        for order in self.timers[symbol].advance(now):
+            if order in self.queues[symbol][order.side]:
+                self.queues[symbol][order.side].delete(order)
+            self.db.pop(order.order_id, None)
+            if __debug__:
+                self.metrics[symbol].count("expiries")
+            self.events.order("Expired", order)
+            for listener in self.listeners:
+                listener.removed(order.order_id)
+
+    def _match(self, order, queue, now: float, trades: list = None):
         while len(queue) > 0:
-            q_top_order, _ = queue.peek()
-            if not q_top_order.is_valid():
+            q_top_order = queue.peek()
+            if not q_top_order.is_valid(now):  # expired within the current timer tick, not evicted by the wheel yet
                 queue.pop()
-                self.logger.info(f"Order Expired: {q_top_order}")
+                self.timers[q_top_order.symbol].remove(q_top_order.order_id)
+                self.db.pop(q_top_order.order_id, None)
+                if __debug__:
+                    self.metrics[q_top_order.symbol].count("expiries")
+                self.events.order("Expired", q_top_order)
+                for listener in self.listeners:
+                    listener.removed(q_top_order.order_id)
             else:
-                if (order.side == "ask" and order.price <= q_top_order.price) or (order.side == "bid" and order.price >= q_top_order.price):
-                    queue.pop()
-                    order_copy, q_top_order_copy = deepcopy(order), deepcopy(q_top_order)
+                if (order.side == "ask" and order.ticks <= q_top_order.ticks) or (order.side == "bid" and order.ticks >= q_top_order.ticks):
                     quantity_filled = min(order.quantity, q_top_order.quantity)
+                    trade = TradeRecord(order, q_top_order, order.quantity, q_top_order.quantity, quantity_filled, time())
                     order.quantity -= quantity_filled
-                    q_top_order.quantity -= quantity_filled
-                    if q_top_order.quantity > 0:
-                        queue.push(q_top_order, q_top_order.order_id)  # push back residual quantity
-                    match_result = {
-                        "accepted_order": json.loads(str(order_copy)),
-                        "matched_order": json.loads(str(q_top_order_copy)),
-                        "quantity_filled": quantity_filled,
-                        "final_price": q_top_order.price,
-                        "price_gap": abs(order.price - q_top_order.price),
-                        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-                    }
-                    self.history.append(match_result)
-                    self.logger.info(f"Matched Orders: {match_result}")
+                    queue.reduce(q_top_order, quantity_filled)  # residual quantity keeps its place in the price level
+                    if q_top_order.quantity == 0:
+                        queue.pop()
+                        self.timers[q_top_order.symbol].remove(q_top_order.order_id)
+                        self.db.pop(q_top_order.order_id, None)  # filled orders live on only in the trade history
+                    self.history.append(trade)
+                    if trades is not None:
+                        trades.append(trade)
+                    if self.journal is not None:
+                        self.journal.fill(trade)
+                    self.events.trade(trade)
+                    for listener in self.listeners:
+                        listener.trade(trade)
                     if order.quantity == 0:
                         return
                 else:
                     return
 
     def accept_order(self, order: Order):
-        self.logger.info(f"[{current_thread().name} {current_thread().native_id}] Accepted Order: {order}")
-        self.db[order.order_id] = order  # persist the order
-        other_side = "ask" if order.side == "bid" else "bid"
-        self.locks[order.symbol][other_side].acquire()
-        self._match(order, self.queues[order.symbol][other_side])
-        self.locks[order.symbol][other_side].release()
+        if __debug__:
+            start = perf_counter_ns()
+        self.events.order("Accepted", order)
+        if __debug__:
+            logged = perf_counter_ns()
+        order.ticks = self.to_ticks(order)
+        now = self.clock()  # one clock read for the whole matching batch
+        request = [order, None, None]  # order, trades, error, filled in by whichever thread gets the symbol lock first
+        pending = self.pending[order.symbol]
+        pending.append(request)
+        if __debug__:
+            waiting = perf_counter_ns()
+        with self.locks[order.symbol]:  # match and rest in one critical section, no other order can cross the book in between
+            if __debug__:
+                locked = perf_counter_ns()
+            if request[1] is None and request[2] is None:  # not drained by the previous holder, drain every accept queued behind the lock
+                self._expire_locked(order.symbol, now)
+                for _ in range(len(pending)):
+                    queued = pending.popleft()
+                    try:
+                        queued[1] = self._accept_locked(queued[0], now)
+                    except Exception as e:
+                        queued[2] = e
+        if __debug__:
+            matched = perf_counter_ns()
+        if request[2] is not None:
+            raise request[2]
+        if __debug__:
+            self.metrics[order.symbol].record_accept(logged - start, locked - waiting, matched - locked, perf_counter_ns() - start, len(request[1]))
+        return order
+
+    def accept_orders(self, orders: List[Order]) -> List[tuple]:  # [(order, quantity left, trades, error)], the whole batch is matched before returning
+        symbol_orders, results = defaultdict(list), list()
+        for order in orders:
+            try:
+                order.ticks = self.to_ticks(order)
+                symbol_orders[order.symbol].append(order)
+            except ValueError as e:
+                results.append((order, order.quantity, None, e))
+        for symbol, orders in symbol_orders.items():
+            self.events.message("Accepted %d %s Orders", len(orders), symbol)
+            now = self.clock()
+            if __debug__:
+                waiting = perf_counter_ns()
+            with self.locks[symbol]:  # once for the whole batch of this symbol
+                if __debug__:
+                    locked = perf_counter_ns()
+                    lock_wait_ns = locked - waiting  # one acquisition for the batch, recorded with its first order
+                self._expire_locked(symbol, now)
+                for order in orders:
+                    if __debug__:
+                        start = perf_counter_ns()
+                    trades = self._accept_locked(order, now)
+                    results.append((order, order.quantity, trades, None))  # quantity left right after this order matched
+                    if __debug__:
+                        self.metrics[symbol].record_accept(None, lock_wait_ns, perf_counter_ns() - start, None, len(trades))  # batches are logged once and have no per order end to end time
+                        lock_wait_ns = None
+        return results  # a caller streaming them cannot leave part of the batch unmatched by going away
+
+    def _accept_locked(self, order: Order, now: float) -> List[TradeRecord]:  # the symbol lock is held
+        if self.journal is not None:
+            self.journal.accept(order)
+        self.db[order.order_id] = order
+        trades = list()
+        if order.symbol not in self.auctions:
+            self._match(order, self.queues[order.symbol]["ask" if order.side == "bid" else "bid"], now, trades)
         if order.quantity > 0:
-            self.locks[order.symbol][order.side].acquire()
-            self.queues[order.symbol][order.side].push(order, order.order_id)
-            self.locks[order.symbol][order.side].release()
+            self.queues[order.symbol][order.side].push(order)
+            self.timers[order.symbol].add(order)
+        else:
+            self.db.pop(order.order_id, None)
+        return trades
+
+    def _cancel_locked(self, order: Order):  # the symbol lock is held
+        queue = self.queues[order.symbol][order.side]
+        if order in queue:  # filled or expired orders are no longer in the book
+            queue.delete(order)
+            self.timers[order.symbol].remove(order.order_id)
+        if self.journal is not None:
+            self.journal.cancel(order.order_id)
+        self.db.pop(order.order_id, None)
+        for listener in self.listeners:
+            listener.removed(order.order_id)
 
     def cancel_order(self, order_id: int):
         if order_id not in self.db:
             raise ValueError(f"Order ID \"{order_id}\" not found in db")
         order = self.db[order_id]
-        self.logger.info(f"[{current_thread().name} {current_thread().native_id}] Cancelled Order: {order}")
-        self.locks[order.symbol][order.side].acquire()
-        self.queues[order.symbol][order.side].delete(order_id)
-        self.locks[order.symbol][order.side].release()
-        del self.db[order_id]
+        now = self.clock()
+        with self.locks[order.symbol]:
+            self._expire_locked(order.symbol, now)  # cancels evict too, a symbol that only sees cancels keeps its book and depth current
+            if order_id not in self.db:
+                raise ValueError(f"Order ID \"{order_id}\" not found in db")  # expired, or filled since the lookup
+            self._cancel_locked(order)
+        self.events.order("Cancelled", order)
+        if __debug__:
+            self.metrics[order.symbol].count("cancels")
         return order
 
+    def cancel_orders(self, account: str = None, symbol: str = None) -> List[Order]:
+        if account is None and symbol is None:
+            raise ValueError("Mass cancel needs an account and/or a symbol")
+        cancelled = list()
+        for book_symbol in ([symbol] if symbol is not None else list(self.queues)):
+            if book_symbol not in self.queues:
+                raise ValueError(f"Symbol \"{book_symbol}\" not loaded")
+            with self.locks[book_symbol]:  # one lock round trip per symbol
+                self._expire_locked(book_symbol, self.clock())  # expired orders are reported as expired, not cancelled
+                for queue in self.queues[book_symbol].values():
+                    orders = list(queue.accounts.get(account, dict()).values()) if account is not None else list(queue)
+                    for order in orders:
+                        self._cancel_locked(order)
+                    cancelled.extend(orders)
+                    if __debug__:
+                        self.metrics[book_symbol].count("cancels", len(orders))
+        self.events.message("Cancelled %d Orders, account: %s, symbol: %s", len(cancelled), account, symbol)
+        return cancelled
+
+    def replace_order(self, order_id: int, order: Order) -> Tuple[Order, List[TradeRecord]]:
+        if order_id not in self.db:
+            raise ValueError(f"Order ID \"{order_id}\" not found in db")
+        old_order = self.db[order_id]
+        if order.symbol != old_order.symbol:
+            raise ValueError(f"Order ID \"{order_id}\" is a {old_order.symbol} order, cannot be replaced by a {order.symbol} order")
+        order.ticks = self.to_ticks(order)
+        if __debug__:
+            start = perf_counter_ns()
+        self.events.order(f"Replaced {order_id} by", order)
+        now = self.clock()
+        if __debug__:
+            logged = perf_counter_ns()
+        with self.locks[order.symbol]:  # no fill can land between the cancel and the new order
+            if __debug__:
+                locked = perf_counter_ns()
+            self._expire_locked(order.symbol, now)
+            if old_order not in self.queues[old_order.symbol][old_order.side]:
+                raise ValueError(f"Order ID \"{order_id}\" is no longer in the book")
+            self._cancel_locked(old_order)
+            trades = self._accept_locked(order, now)
+            if __debug__:
+                matched = perf_counter_ns()
+        if __debug__:
+            self.metrics[order.symbol].count("cancels")
+            self.metrics[order.symbol].record_accept(logged - start, locked - logged, matched - locked, perf_counter_ns() - start, len(trades))
+        return old_order, trades
+
+    def start_auction(self, symbol: str, interval: float = None):  # opening/closing cross, or a batch auction every interval seconds
+        if symbol not in self.queues:
+            raise ValueError(f"Symbol \"{symbol}\" not loaded")
+        if symbol in self.auctions:
+            raise ValueError(f"Symbol \"{symbol}\" is already in an auction")
+        ended = self.auctions[symbol] = Event()
+        self.events.message("Auction started for %s, interval: %s", symbol, interval)
+        if interval is not None:
+            Thread(target=self._auction_loop, args=(symbol, interval, ended), name=f"auction-{symbol}", daemon=True).start()
+
+    def _auction_loop(self, symbol: str, interval: float, ended: Event):
+        while not ended.wait(interval):
+            self.uncross(symbol)
+
+    def end_auction(self, symbol: str) -> Tuple[float, List[TradeRecord]]:  # final cross, then back to continuous matching
+        if symbol not in self.auctions:
+            raise ValueError(f"Symbol \"{symbol}\" is not in an auction")
+        now = self.clock()
+        with self.locks[symbol]:
+            self._expire_locked(symbol, now)
+            price, trades = self._uncross_locked(symbol, now)
+            self.auctions.pop(symbol).set()  # under the locks, no order can match against a crossed book
+        return price, trades
+
+    def uncross(self, symbol: str) -> Tuple[float, List[TradeRecord]]:
+        if symbol not in self.auctions:
+            raise ValueError(f"Symbol \"{symbol}\" is not in an auction")
+        now = self.clock()
+        with self.locks[symbol]:
+            self._expire_locked(symbol, now)
+            return self._uncross_locked(symbol, now)
+
+    def _uncross_locked(self, symbol: str, now: float) -> Tuple[float, List[TradeRecord]]:  # the symbol lock is held
+        asks, bids = self.queues[symbol]["ask"], self.queues[symbol]["bid"]
+        ask_levels, bid_levels = list(asks.levels.values()), list(bids.levels.values())
+        ticks, volume = clearing_price([level.ticks for level in ask_levels], [level.quantity for level in ask_levels],
+                                       [level.ticks for level in bid_levels], [level.quantity for level in bid_levels])
+        if ticks is None:
+            return None, list()
+        price = (asks.levels.get(ticks) or bids.levels[ticks]).price  # every candidate is a resting level, keep its price as submitted
+        trades = list()
+        while len(asks) > 0 and len(bids) > 0:  # best bid against best ask, FIFO within a level, all at the clearing price
+            ask, bid = asks.peek(), bids.peek()
+            expired = [(queue, order) for queue, order in ((asks, ask), (bids, bid)) if not order.is_valid(now)]
+            for queue, order in expired:
+                queue.pop()
+                self.timers[symbol].remove(order.order_id)
+                self.db.pop(order.order_id, None)
+                if __debug__:
+                    self.metrics[symbol].count("expiries")
+                self.events.order("Expired", order)
+                for listener in self.listeners:
+                    listener.removed(order.order_id)
+            if expired:
+                continue
+            if ask.ticks > ticks or bid.ticks < ticks:
+                break
+            later, earlier = (ask, bid) if ask.created_ns > bid.created_ns else (bid, ask)
+            quantity_filled = min(ask.quantity, bid.quantity)
+            trade = TradeRecord(later, earlier, later.quantity, earlier.quantity, quantity_filled, time(), price)
+            for queue, order in ((asks, ask), (bids, bid)):
+                queue.reduce(order, quantity_filled)
+                if order.quantity == 0:
+                    queue.pop()
+                    self.timers[symbol].remove(order.order_id)
+                    self.db.pop(order.order_id, None)
+            self.history.append(trade)
+            trades.append(trade)
+            if self.journal is not None:
+                self.journal.fill(trade)
+            self.events.trade(trade)
+            for listener in self.listeners:
+                listener.trade(trade)
+        if __debug__:
+            self.metrics[symbol].count("fills", len(trades))
+        self.events.message("Auction uncrossed %s at %s, volume: %d, trades: %d", symbol, price, volume, len(trades))
+        return price, trades
+
+    def read_book(self, symbol: str, read, retries: int = 8):
+        lock = self.locks[symbol]
+        for _ in range(retries):  # optimistic: copy without the lock, keep the copy if no writer held the lock meanwhile
+            sequence = lock.sequence
+            if sequence % 2 == 0:
+                try:
+                    result = read()
+                    if lock.sequence == sequence:
+                        return sequence, result
+                except (RuntimeError, KeyError, IndexError, StopIteration):  # the book changed under the copy
+                    pass
+            sleep(0)
+        with lock:  # a book too busy to copy optimistically, copy it once under the lock
+            return lock.sequence, read()
+
     def view_orders(self, symbol, include_expired: bool = False, size: int = None) -> str:
-        ask_view = self.queues[symbol]["ask"].top_n(size)
-        bid_view = self.queues[symbol]["bid"].top_n(size)
+        # never evicts, expired orders are left to the next write to the symbol and skipped here unless include_expired
+        now = self.clock()
+        key = (symbol, size, include_expired)
+        cached = self.order_views.get(key)
+        if cached is not None and cached[0] == self.locks[symbol].sequence and now <= cached[1]:
+            _, _, ask_view, bid_view = cached
+        else:
+            asks, bids = self.queues[symbol]["ask"], self.queues[symbol]["bid"]
+            valid_at = None if include_expired else now
+            sequence, (ask_view, bid_view) = self.read_book(symbol, lambda: (asks.top_n(size, valid_at), bids.top_n(size, valid_at)))
+            if size in self.CACHED_SIZES:
+                valid_until = float("inf") if include_expired else min((order.expire_at for order, _ in ask_view + bid_view), default=float("inf"))
+                self.order_views[key] = (sequence, valid_until, ask_view, bid_view)
         table = PrettyTable(["Symbol", "Type", "Price", "Quantity", "Order ID", "Created", "Time Left"])
-        for order, _ in ask_view[::-1]:
-            if not include_expired and not order.is_valid():
-                continue
-            table.add_row([order.symbol, order.side, order.price, order.quantity, order.order_id, order.time.strftime("%Y-%m-%d %H:%M:%S"), order.time_left()])
+        for order, quantity in ask_view[::-1]:
+            table.add_row([order.symbol, order.side, order.price, quantity, order.order_id, order.time.strftime("%Y-%m-%d %H:%M:%S"), order.time_left(now)])
         table.add_row(["-"] * len(table.field_names))
-        for order, _ in bid_view:
-            if not include_expired and not order.is_valid():
-                continue
-            table.add_row([order.symbol, order.side, order.price, order.quantity, order.order_id, order.time.strftime("%Y-%m-%d %H:%M:%S"), order.time_left()])
+        for order, quantity in bid_view:
+            table.add_row([order.symbol, order.side, order.price, quantity, order.order_id, order.time.strftime("%Y-%m-%d %H:%M:%S"), order.time_left(now)])
         return table.get_string() + "\n"
 
+    def view_depth(self, symbol: str, levels: int = 10) -> str:  # never evicts, every write to the symbol and the sweeper take expired orders out of the totals
+        if levels < 1:
+            raise ValueError(f"Depth levels must be at least 1, got {levels}")
+        ask_queue, bid_queue = self.queues[symbol]["ask"], self.queues[symbol]["bid"]
+        cached = self.depth_cache.get((symbol, levels))
+        if cached is not None and cached[0] == ask_queue.version and cached[1] == bid_queue.version:
+            return cached[2]
+        _, (ask_version, asks, bid_version, bids) = self.read_book(  # both sides from the same instant, never crossed outside an auction
+            symbol, lambda: (ask_queue.version, ask_queue.depth(levels), bid_queue.version, bid_queue.depth(levels)))
+        depth = json.dumps({"symbol": symbol, "version": [ask_version, bid_version], "asks": asks, "bids": bids})
+        if levels in self.CACHED_LEVELS:
+            self.depth_cache[(symbol, levels)] = (ask_version, bid_version, depth)
+        return depth
 
-# Web Service
-import argparse
-import os
-from flask import Flask, Response, request
-from logging.config import dictConfig
-
-dictConfig({
-    'version': 1,
-    'formatters': {'default': {'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',}},
-    'handlers': {'wsgi': {'class': 'logging.StreamHandler', 'stream': 'ext://flask.logging.wsgi_errors_stream', 'formatter': 'default'}},
-    'root': {'level': 'INFO', 'handlers': ['wsgi']}
-})
-
-web = Flask(__name__)
-engine = MatchingEngine(logger=web.logger)
-
-
-@web.route("/order", methods=["GET", "POST", "DELETE"])
-def order():
-    if request.method == "GET":
-        symbol = request.args.get("symbol")
-        size = int(request.args.get("size")) if "size" in request.args else None
-        include_expired = True if "include_expired" in request.args else False
-        view = engine.view_orders(symbol, include_expired, size)
-        return Response(response=view, content_type='text/plain; chatset=utf-8', status=200)
-    elif request.method == "POST":
-        data = request.get_json()
-        order = Order(int(data["order_id"]), data["symbol"], data["side"], data["price"], data["quantity"], data["account"], data["expire_sec"])
-        engine.accept_order(order)
-        return Response(response=f"Posted order: {order}\n", content_type='text/plain; chatset=utf-8', status=200)
-    elif request.method == "DELETE":
-        order_id = int(request.args.get("order_id"))
-        order = engine.cancel_order(order_id)
-        return Response(response=f"Cancelled order: {order}\n", content_type='text/plain; chatset=utf-8', status=200)
-
-
-@web.route("/history", methods=["GET"])
-def history():
-    return Response(response=engine.view_history(), content_type='text/plain; chatset=utf-8', status=200)
-
-
-PARSER = argparse.ArgumentParser(description="Web host and port")
-PARSER.add_argument("-H", "--host", dest="host", default="localhost", help="Host or IP")
-PARSER.add_argument("-p", "--port", dest="port", default=9999, help="Port")
-PARSER.add_argument("-s", "--symbols", dest="symbols", default="AAPL,MSFT", help="Trading Symbols, delimiter = ','")
-ARGUMENTS = PARSER.parse_args()
-if __name__ == "__main__":
-    engine.load_symbols(ARGUMENTS.symbols.split(","))
-    web.run(host=ARGUMENTS.host, port=ARGUMENTS.port, threaded=True, debug=True)
+    def collect_metrics(self) -> Dict[str, tuple]:
+        collected = dict()
+        for symbol, metrics in self.metrics.items():
+            counters, latency = metrics.collect()
+            book = {side: (len(queue), len(queue.levels)) for side, queue in self.queues[symbol].items()}
+            collected[symbol] = (counters, latency, book)
+        return collected
+
+    @staticmethod
+    def format_metrics(collected: Dict[str, tuple]) -> str:  # prometheus text exposition format
+        lines = ["# TYPE order_matching_events_total counter"]
+        for symbol, (counters, _, _) in collected.items():
+            lines.extend(f'order_matching_events_total{{symbol="{symbol}",event="{event}"}} {value}' for event, value in counters.items())
+        lines.append("# TYPE order_matching_stage_seconds summary")
+        for symbol, (_, latency, _) in collected.items():
+            for stage, histogram in latency.items():
+                labels = f'symbol="{symbol}",stage="{stage}"'
+                quantiles = [0.5, 0.9, 0.99, 0.999]
+                for quantile, value in zip(quantiles, histogram.percentiles([q * 100 for q in quantiles])):
+                    lines.append(f'order_matching_stage_seconds{{{labels},quantile="{quantile}"}} {value / 1e9:.9f}')
+                lines.append(f"order_matching_stage_seconds_sum{{{labels}}} {histogram.sum / 1e9:.9f}")
+                lines.append(f"order_matching_stage_seconds_count{{{labels}}} {histogram.total}")
+        lines.append("# TYPE order_matching_book_orders gauge")
+        for symbol, (_, _, book) in collected.items():
+            lines.extend(f'order_matching_book_orders{{symbol="{symbol}",side="{side}"}} {orders}' for side, (orders, _) in book.items())
+        lines.append("# TYPE order_matching_book_levels gauge")
+        for symbol, (_, _, book) in collected.items():
+            lines.extend(f'order_matching_book_levels{{symbol="{symbol}",side="{side}"}} {levels}' for side, (_, levels) in book.items())
+        return "\n".join(lines) + "\n"
+
+    def view_metrics(self) -> str:
+        return self.format_metrics(self.collect_metrics())
+
+    def close(self):  # the journal belongs to the caller
+        self.closing.set()
+        self.history.close()
+        self.events.close()
+
+
+def run_shard(connection, history_capacity: int = 100000, history_spill_path: str = None, journal_directory: str = None, snapshot_interval: float = None,
+              event_level: int = EventLog.FULL):
+    journal = Journal(journal_directory, snapshot_interval=snapshot_interval) if journal_directory is not None else None
+    engine = MatchingEngine(history_capacity=history_capacity, history_spill_path=history_spill_path, journal=journal,
+                            event_level=event_level)  # single threaded, the only caller is this loop
+    while True:
+        method, args = connection.recv()
+        if method is None:
+            break
+        try:
+            attribute = getattr(engine, method)
+            result = attribute(*args) if callable(attribute) else attribute
+            connection.send((list(result) if isgenerator(result) else result, None))
+        except Exception as e:
+            connection.send((None, e))
+    if journal is not None:
+        journal.close()
+    engine.close()
+    connection.close()
+
+
+class ShardedMatchingEngine:
+    def __init__(self, shards: int = os.cpu_count(), logger=logger, history_capacity: int = 100000, history_spill_path: str = None,
+                 journal_directory: str = None, snapshot_interval: float = None, event_level: int = EventLog.FULL):
+        self.logger = logger
+        self.events = EventLog(logger, event_level)
+        self.shards = list()  # [(process, connection, lock)]
+        self.routes = dict()  # {order_id: (shard, expire_at)}, resting orders only, filled and expired orders are pruned
+        self.expiries = list()  # heap of (expire_at, order_id) over the routes, may hold orders already filled or cancelled
+        self.routes_lock = Lock()
+        self.listeners = list()  # as MatchingEngine.listeners, told of what the router sees: trades it gets back, cancels and expiries of routed orders
+        for shard in range(shards):
+            connection, shard_connection = Pipe()
+            spill_path = f"{history_spill_path}.{shard}" if history_spill_path is not None else None
+            shard_journal_directory = os.path.join(journal_directory, f"shard_{shard}") if journal_directory is not None else None
+            process = Process(target=run_shard, args=(shard_connection, history_capacity, spill_path, shard_journal_directory, snapshot_interval, event_level),
+                              daemon=True)
+            process.start()
+            self.shards.append((process, connection, Lock()))
+
+    def shard_of(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) % len(self.shards)  # str hash() is salted per process
+
+    def _call(self, shard: int, method: str, *args):
+        _, connection, lock = self.shards[shard]
+        with lock:
+            connection.send((method, args))
+            result, error = connection.recv()
+        if error is not None:
+            raise error
+        return result
+
+    def load_symbols(self, symbols: List[str], tick_sizes: Dict[str, float] = None):
+        shard_symbols = defaultdict(list)
+        for symbol in symbols:
+            shard_symbols[self.shard_of(symbol)].append(symbol)
+        for shard, symbols in shard_symbols.items():
+            self._call(shard, "load_symbols", symbols, tick_sizes)
+
+    def _route(self, shard: int, orders: List[Order], trades: List[TradeRecord] = ()):  # orders that rest after matching, trades that may have filled routed ones
+        now, expired = monotonic(), list()
+        with self.routes_lock:
+            for trade in trades:
+                for order, quantity in ((trade.accepted_order, trade.accepted_quantity), (trade.matched_order, trade.matched_quantity)):
+                    if quantity == trade.quantity_filled:  # filled by this trade
+                        self.routes.pop(order.order_id, None)
+            for order in orders:
+                if order.quantity > 0:
+                    self.routes[order.order_id] = (shard, order.expire_at)
+                    heappush(self.expiries, (order.expire_at, order.order_id))
+            while self.expiries and self.expiries[0][0] < now:
+                expire_at, order_id = heappop(self.expiries)
+                if self.routes.get(order_id, (None, None))[1] == expire_at:
+                    del self.routes[order_id]
+                    expired.append(order_id)
+            if len(self.expiries) > 2 * len(self.routes) + 1024:  # mostly filled or cancelled orders, rebuild from the routes
+                self.expiries = [(expire_at, order_id) for order_id, (_, expire_at) in self.routes.items()]
+                heapify(self.expiries)
+        for listener in self.listeners:
+            for trade in trades:
+                listener.trade(trade)
+            for order_id in expired:
+                listener.removed(order_id)
+
+    def _unroute(self, order_id: int) -> int:
+        with self.routes_lock:
+            if order_id not in self.routes:
+                raise ValueError(f"Order ID \"{order_id}\" not found in db")
+            return self.routes.pop(order_id)[0]
+
+    def recover(self):
+        for shard in range(len(self.shards)):
+            self._call(shard, "recover")
+            self._route(shard, list(self._call(shard, "db").values()))
+
+    def accept_order(self, order: Order):
+        shard = self.shard_of(order.symbol)
+        self.events.message("Routed Order %s to Shard %d", order.order_id, shard)
+        [(_, quantity, trades, error)] = self._call(shard, "accept_orders", [order])  # with the trades, so routes of filled orders can be pruned
+        if error is not None:
+            raise error
+        order.quantity = quantity  # the shard matched a copy of the order
+        self._route(shard, [order], trades)
+        return order
+
+    def accept_orders(self, orders: List[Order]) -> List[tuple]:
+        shard_orders, results = defaultdict(list), list()
+        for order in orders:
+            shard_orders[self.shard_of(order.symbol)].append(order)
+        for shard, orders in shard_orders.items():  # every shard matches its part before anything is returned
+            shard_results = self._call(shard, "accept_orders", orders)
+            self._route(shard, [order for order, _, _, error in shard_results if error is None], [trade for _, _, trades, _ in shard_results for trade in trades or ()])
+            results.extend(shard_results)
+        return results
+
+    def cancel_order(self, order_id: int):
+        try:
+            return self._call(self._unroute(order_id), "cancel_order", order_id)  # a route the shard no longer knows is dropped as well
+        finally:
+            for listener in self.listeners:
+                listener.removed(order_id)
+
+    def cancel_orders(self, account: str = None, symbol: str = None) -> List[Order]:
+        cancelled = list()
+        for shard in ([self.shard_of(symbol)] if symbol is not None else range(len(self.shards))):
+            cancelled.extend(self._call(shard, "cancel_orders", account, symbol))
+        with self.routes_lock:
+            for order in cancelled:
+                self.routes.pop(order.order_id, None)
+        for listener in self.listeners:
+            for order in cancelled:
+                listener.removed(order.order_id)
+        return cancelled
+
+    def replace_order(self, order_id: int, order: Order) -> Tuple[Order, List[TradeRecord]]:
+        with self.routes_lock:
+            if order_id not in self.routes:
+                raise ValueError(f"Order ID \"{order_id}\" not found in db")
+            shard = self.routes[order_id][0]
+        old_order, trades = self._call(shard, "replace_order", order_id, order)
+        with self.routes_lock:
+            self.routes.pop(order_id, None)
+        for listener in self.listeners:
+            listener.removed(order_id)
+        order.quantity = trades[-1].accepted_quantity - trades[-1].quantity_filled if trades else order.quantity
+        self._route(shard, [order], trades)
+        return old_order, trades
+
+    def start_auction(self, symbol: str, interval: float = None):
+        return self._call(self.shard_of(symbol), "start_auction", symbol, interval)
+
+    def start_sweeper(self, interval: float = 0.1):
+        for shard in range(len(self.shards)):
+            self._call(shard, "start_sweeper", interval)
+
+    def uncross(self, symbol: str) -> Tuple[float, List[TradeRecord]]:  # crosses run by the shard's own interval loop are pruned on expiry or cancel
+        shard = self.shard_of(symbol)
+        price, trades = self._call(shard, "uncross", symbol)
+        self._route(shard, list(), trades)
+        return price, trades
+
+    def end_auction(self, symbol: str) -> Tuple[float, List[TradeRecord]]:
+        shard = self.shard_of(symbol)
+        price, trades = self._call(shard, "end_auction", symbol)
+        self._route(shard, list(), trades)
+        return price, trades
+
+    def view_orders(self, symbol, include_expired: bool = False, size: int = None) -> str:
+        return self._call(self.shard_of(symbol), "view_orders", symbol, include_expired, size)
+
+    def view_depth(self, symbol: str, levels: int = 10) -> str:
+        return self._call(self.shard_of(symbol), "view_depth", symbol, levels)
+
+    def view_metrics(self) -> str:
+        collected = dict()
+        for shard in range(len(self.shards)):
+            collected.update(self._call(shard, "collect_metrics"))  # symbols are disjoint across shards
+        return MatchingEngine.format_metrics(collected)
+
+    def view_history(self):
+        history = list()
+        for shard in range(len(self.shards)):
+            history.extend(self._call(shard, "history"))
+        return MatchingEngine.format_history(sorted(history, key=lambda trade: trade.time))
+
+    def query_history(self, symbol: str = None, account: str = None, cursor: str = None, since: float = None, limit: int = 100) -> Tuple[List[TradeRecord], str]:
+        cursors = cursor.split(".") if cursor else ["0"] * len(self.shards)  # one trade_id cursor per shard
+        trades, shard_pages = list(), dict()
+        for shard in ([self.shard_of(symbol)] if symbol is not None else range(len(self.shards))):
+            records, next_cursor = self._call(shard, "query_history", symbol, account, cursors[shard], since, limit)
+            trades.extend((record, shard) for record in records)
+            shard_pages[shard] = (len(records), next_cursor)
+        trades = sorted(trades, key=lambda trade: trade[0].time)[:limit]
+        taken = defaultdict(int)
+        for record, shard in trades:
+            taken[shard] += 1
+            cursors[shard] = str(record.trade_id + 1)
+        for shard, (count, next_cursor) in shard_pages.items():
+            if taken[shard] == count:  # the whole page of this shard was returned
+                cursors[shard] = next_cursor
+        return [record for record, _ in trades], ".".join(cursors)
+
+    def close(self):
+        for process, connection, lock in self.shards:
+            with lock:
+                connection.send((None, None))
+            process.join()
+        self.events.close()
 
 
 """
-orders=(
-    '{"order_id":"1","symbol":"MSFT","side":"ask","price":200,"quantity":3,"account":"Trader_A","expire_sec":20}'
-    '{"order_id":"2","symbol":"MSFT","side":"ask","price":180,"quantity":5,"account":"Trader_B","expire_sec":20}'
-    '{"order_id":"3","symbol":"MSFT","side":"ask","price":170,"quantity":2,"account":"Trader_B","expire_sec":1}'
-    '{"order_id":"4","symbol":"AAPL","side":"ask","price":200,"quantity":3,"account":"Trader_A","expire_sec":20}'
-    '{"order_id":"5","symbol":"MSFT","side":"bid","price":170,"quantity":4,"account":"Trader_C","expire_sec":20}'
-    '{"order_id":"6","symbol":"MSFT","side":"bid","price":150,"quantity":1,"account":"Trader_D","expire_sec":20}'
-    '{"order_id":"7","symbol":"MSFT","side":"ask","price":170,"quantity":3,"account":"Trader_A","expire_sec":20}'
-    '{"order_id":"8","symbol":"MSFT","side":"bid","price":160,"quantity":2,"account":"Trader_E","expire_sec":20}'
-    '{"order_id":"9","symbol":"MSFT","side":"ask","price":190,"quantity":4,"account":"Trader_F","expire_sec":20}'
-    '{"order_id":"10","symbol":"MSFT","side":"bid","price":185,"quantity":5,"account":"Trader_G","expire_sec":20}'
-    '{"order_id":"11","symbol":"AAPL","side":"bid","price":210,"quantity":3,"account":"Trader_E","expire_sec":20}'
-    '{"order_id":"12","symbol":"MSFT","side":"ask","price":175,"quantity":2,"account":"Trader_H","expire_sec":20}'
-    '{"order_id":"13","symbol":"MSFT","side":"bid","price":190,"quantity":1,"account":"Trader_I","expire_sec":20}'
-    '{"order_id":"14","symbol":"MSFT","side":"bid","price":160,"quantity":3,"account":"Trader_E","expire_sec":20}'
-)
-
-for order in ${orders[@]}; do curl -X POST http://localhost:9999/order -H 'Content-Type: application/json' -d "${order}"; done
-
-curl "http://localhost:9999/order?symbol=MSFT"
-curl -X DELETE "http://localhost:9999/order?order_id=1"
-curl "http://localhost:9999/order?symbol=MSFT"
-curl "http://localhost:9999/history" | jq
-curl "http://localhost:9999/order?symbol=MSFT&include_expired"
-curl "http://localhost:9999/order?symbol=MSFT&size=2"
-
-
-exec(open("matching_engine.py").read())
+from order_matching_engine import MatchingEngine, Order
 m = MatchingEngine()
 m.load_symbols(["AAPL", "MSFT"])
 orders = [
@@ -258,4 +1507,3 @@ orders = [
 order_itr = iter(orders)
 m.accept_order(next(order_itr))
 """
-
@@ -0,0 +1,168 @@
+import argparse
+import json
+from flask import Flask, Response, request
+from logging.config import dictConfig
+from order_matching_engine import EventLog, Journal, MatchingEngine, Order, ShardedMatchingEngine, parse_symbols
+
+
+dictConfig({
+    'version': 1,
+    'formatters': {'default': {'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',}},
+    'handlers': {'wsgi': {'class': 'logging.StreamHandler', 'stream': 'ext://flask.logging.wsgi_errors_stream', 'formatter': 'default'}},
+    'root': {'level': 'INFO', 'handlers': ['wsgi']}
+})
+
+web = Flask(__name__)
+engine = MatchingEngine(logger=web.logger)
+
+
+@web.route("/order", methods=["GET", "POST", "PUT", "DELETE"])
+def order():
+    if request.method == "GET":
+        symbol = request.args.get("symbol")
+        size = int(request.args.get("size")) if "size" in request.args else None
+        include_expired = True if "include_expired" in request.args else False  # expired orders are only evicted by writes, this shows those still resting
+        view = engine.view_orders(symbol, include_expired, size)
+        return Response(response=view, content_type='text/plain; chatset=utf-8', status=200)
+    elif request.method == "POST":
+        order = Order.from_dict(request.get_json())
+        engine.accept_order(order)
+        return Response(response=f"Posted order: {order}\n", content_type='text/plain; chatset=utf-8', status=200)
+    elif request.method == "PUT":  # cancel-replace
+        order = Order.from_dict(request.get_json())
+        old_order, _ = engine.replace_order(int(request.args.get("order_id")), order)
+        return Response(response=f"Replaced order: {old_order}\nPosted order: {order}\n", content_type='text/plain; chatset=utf-8', status=200)
+    elif request.method == "DELETE":
+        order_id = int(request.args.get("order_id"))
+        order = engine.cancel_order(order_id)
+        return Response(response=f"Cancelled order: {order}\n", content_type='text/plain; chatset=utf-8', status=200)
+
+
+@web.route("/orders", methods=["POST", "DELETE"])
+def orders():
+    if request.method == "DELETE":  # mass cancel by account and/or symbol
+        cancelled = engine.cancel_orders(request.args.get("account"), request.args.get("symbol"))
+        return Response(response=(json.dumps(order.to_dict()) + "\n" for order in cancelled), content_type='application/x-ndjson; charset=utf-8', status=200)
+    body = request.get_data(as_text=True).strip()
+    batch = [Order.from_dict(data) for data in (json.loads(body) if body.startswith("[") else map(json.loads, filter(None, body.splitlines())))]
+    results = engine.accept_orders(batch)  # matched in full here, a client leaving mid-stream only misses lines
+
+    def stream():  # NDJSON, one line per order followed by its fills
+        for order, quantity, trades, error in results:
+            if error is not None:
+                yield json.dumps({"event": "rejected", "order_id": order.order_id, "error": str(error)}) + "\n"
+            else:
+                yield json.dumps({"event": "accepted", "order": order.to_dict(quantity)}) + "\n"
+                for trade in trades:
+                    yield json.dumps({"event": "fill", **trade.to_dict()}) + "\n"
+
+    return Response(response=stream(), content_type='application/x-ndjson; charset=utf-8', status=200)
+
+
+@web.route("/auction", methods=["POST", "PUT", "DELETE"])
+def auction():
+    symbol = request.args.get("symbol")
+    if request.method == "POST":  # collect orders without matching, uncrossed every interval seconds if given
+        interval = float(request.args.get("interval")) if "interval" in request.args else None
+        engine.start_auction(symbol, interval)
+        return Response(response=f"Auction started: {symbol}\n", content_type='text/plain; chatset=utf-8', status=200)
+    price, trades = engine.uncross(symbol) if request.method == "PUT" else engine.end_auction(symbol)  # DELETE uncrosses and resumes continuous matching
+    lines = [{"event": "uncrossed", "symbol": symbol, "price": price, "trades": len(trades)}] + [{"event": "fill", **trade.to_dict()} for trade in trades]
+    return Response(response=(json.dumps(line) + "\n" for line in lines), content_type='application/x-ndjson; charset=utf-8', status=200)
+
+
+@web.route("/depth", methods=["GET"])
+def depth():
+    symbol = request.args.get("symbol")
+    levels = int(request.args.get("levels")) if "levels" in request.args else 10
+    if levels < 1:
+        return Response(response=f"Depth levels must be at least 1, got {levels}\n", content_type='text/plain; chatset=utf-8', status=400)
+    return Response(response=engine.view_depth(symbol, levels), content_type='application/json; charset=utf-8', status=200)
+
+
+@web.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(response=engine.view_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8', status=200)
+
+
+@web.route("/history", methods=["GET"])
+def history():
+    since = float(request.args.get("since")) if "since" in request.args else None  # epoch seconds
+    limit = int(request.args.get("limit")) if "limit" in request.args else 1000
+    trades, cursor = engine.query_history(request.args.get("symbol"), request.args.get("account"), request.args.get("cursor"), since, limit)
+    return Response(response=(json.dumps(trade.to_dict()) + "\n" for trade in trades), content_type='application/x-ndjson; charset=utf-8', status=200,
+                    headers={"X-Next-Cursor": cursor})  # streamed one trade per chunk, pass the cursor back for the next page
+
+
+PARSER = argparse.ArgumentParser(description="Web host and port")
+PARSER.add_argument("-H", "--host", dest="host", default="localhost", help="Host or IP")
+PARSER.add_argument("-p", "--port", dest="port", default=9999, help="Port")
+PARSER.add_argument("-s", "--symbols", dest="symbols", default="AAPL,MSFT", help="Trading Symbols with optional tick sizes, e.g. AAPL:0.01,MSFT, delimiter = ','")
+PARSER.add_argument("-c", "--history-capacity", dest="history_capacity", default=100000, type=int, help="Trades kept in memory")
+PARSER.add_argument("-f", "--history-spill", dest="history_spill", default=None, help="File to spill trades evicted from memory")
+PARSER.add_argument("-j", "--journal", dest="journal", default=None, help="Journal directory, the books are recovered from it on start")
+PARSER.add_argument("-i", "--snapshot-interval", dest="snapshot_interval", default=None, type=float, help="Seconds between book snapshots")
+PARSER.add_argument("-l", "--event-log", dest="event_log", default="full", choices=EventLog.LEVELS, help="Order and fill event logging, compact skips full order dumps")
+PARSER.add_argument("-b", "--binary-port", dest="binary_port", default=None, type=int, help="Also accept binary orders over TCP on this port, see order_matching_tcp.py")
+PARSER.add_argument("-w", "--workers", dest="workers", default=1, type=int, help="Matching processes, symbols are sharded across them when > 1")
+ARGUMENTS = PARSER.parse_args()
+if __name__ == "__main__":
+    if ARGUMENTS.workers > 1:
+        engine = ShardedMatchingEngine(ARGUMENTS.workers, web.logger, ARGUMENTS.history_capacity, ARGUMENTS.history_spill, ARGUMENTS.journal, ARGUMENTS.snapshot_interval,
+                                       EventLog.LEVELS[ARGUMENTS.event_log])
+    else:
+        journal = Journal(ARGUMENTS.journal, snapshot_interval=ARGUMENTS.snapshot_interval) if ARGUMENTS.journal is not None else None
+        engine = MatchingEngine(web.logger, ARGUMENTS.history_capacity, ARGUMENTS.history_spill, journal, event_level=EventLog.LEVELS[ARGUMENTS.event_log])
+    engine.load_symbols(*parse_symbols(ARGUMENTS.symbols))
+    if ARGUMENTS.journal is not None:
+        engine.recover()
+    engine.start_sweeper()  # symbols without writes still lose their expired orders every wheel tick
+    if ARGUMENTS.binary_port is not None:
+        from order_matching_tcp import OrderEntryServer
+        OrderEntryServer(engine, ARGUMENTS.host, ARGUMENTS.binary_port).start()  # same engine as the http routes
+    try:
+        web.run(host=ARGUMENTS.host, port=ARGUMENTS.port, threaded=True, debug=True,
+                use_reloader=ARGUMENTS.workers <= 1 and ARGUMENTS.journal is None and ARGUMENTS.binary_port is None)  # the reloader would start shards, journals and listeners twice
+    finally:
+        engine.close()  # flushes the event log and the trade spill file
+        if ARGUMENTS.workers <= 1 and journal is not None:
+            journal.close()
+
+
+"""
+orders=(
+    '{"order_id":"1","symbol":"MSFT","side":"ask","price":200,"quantity":3,"account":"Trader_A","expire_sec":20}'
+    '{"order_id":"2","symbol":"MSFT","side":"ask","price":180,"quantity":5,"account":"Trader_B","expire_sec":20}'
+    '{"order_id":"3","symbol":"MSFT","side":"ask","price":170,"quantity":2,"account":"Trader_B","expire_sec":1}'
+    '{"order_id":"4","symbol":"AAPL","side":"ask","price":200,"quantity":3,"account":"Trader_A","expire_sec":20}'
+    '{"order_id":"5","symbol":"MSFT","side":"bid","price":170,"quantity":4,"account":"Trader_C","expire_sec":20}'
+    '{"order_id":"6","symbol":"MSFT","side":"bid","price":150,"quantity":1,"account":"Trader_D","expire_sec":20}'
+    '{"order_id":"7","symbol":"MSFT","side":"ask","price":170,"quantity":3,"account":"Trader_A","expire_sec":20}'
+    '{"order_id":"8","symbol":"MSFT","side":"bid","price":160,"quantity":2,"account":"Trader_E","expire_sec":20}'
+    '{"order_id":"9","symbol":"MSFT","side":"ask","price":190,"quantity":4,"account":"Trader_F","expire_sec":20}'
+    '{"order_id":"10","symbol":"MSFT","side":"bid","price":185,"quantity":5,"account":"Trader_G","expire_sec":20}'
+    '{"order_id":"11","symbol":"AAPL","side":"bid","price":210,"quantity":3,"account":"Trader_E","expire_sec":20}'
+    '{"order_id":"12","symbol":"MSFT","side":"ask","price":175,"quantity":2,"account":"Trader_H","expire_sec":20}'
+    '{"order_id":"13","symbol":"MSFT","side":"bid","price":190,"quantity":1,"account":"Trader_I","expire_sec":20}'
+    '{"order_id":"14","symbol":"MSFT","side":"bid","price":160,"quantity":3,"account":"Trader_E","expire_sec":20}'
+)
+
+for order in ${orders[@]}; do curl -X POST http://localhost:9999/order -H 'Content-Type: application/json' -d "${order}"; done
+printf '%s\n' "${orders[@]}" | curl -X POST http://localhost:9999/orders -H 'Content-Type: application/x-ndjson' --data-binary @-
+
+curl "http://localhost:9999/order?symbol=MSFT"
+curl -X DELETE "http://localhost:9999/order?order_id=1"
+curl -X PUT "http://localhost:9999/order?order_id=9" -H 'Content-Type: application/json' -d '{"order_id":"15","symbol":"MSFT","side":"ask","price":188,"quantity":4,"account":"Trader_F","expire_sec":20}'
+curl -X DELETE "http://localhost:9999/orders?account=Trader_E&symbol=MSFT"
+curl "http://localhost:9999/order?symbol=MSFT"
+curl "http://localhost:9999/history" | jq
+curl -i "http://localhost:9999/history?symbol=MSFT&account=Trader_E&limit=2"
+curl "http://localhost:9999/history?symbol=MSFT&cursor=3" | jq
+curl "http://localhost:9999/order?symbol=MSFT&include_expired"  # also lists orders past expiry that no write to MSFT has evicted yet, views never evict
+curl "http://localhost:9999/order?symbol=MSFT&size=2"
+curl "http://localhost:9999/depth?symbol=MSFT&levels=5" | jq
+curl "http://localhost:9999/metrics"
+curl -X POST "http://localhost:9999/auction?symbol=MSFT"   # opening auction, orders rest without matching
+curl -X DELETE "http://localhost:9999/auction?symbol=MSFT" # opening cross, then continuous matching
+
+"""
@@ -0,0 +1,243 @@
+import argparse
+import socket
+import struct
+from order_matching_engine import MatchingEngine, Order, TradeRecord, parse_symbols
+from collections import deque
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+from threading import Condition, Thread
+from typing import List
+
+
+class OrderEntryProtocol:  # little endian, every message is a u16 body length followed by a fixed width body
+    NEW, CANCEL, ACK, FILL, CANCELLED, REJECT = b"N"[0], b"C"[0], b"A"[0], b"F"[0], b"X"[0], b"R"[0]
+    FRAME = struct.Struct("<H")                         # body length
+    NEW_ORDER = struct.Struct("<Bq8sBdq16sd")           # type, order_id, symbol, side, price, quantity, account, expire_sec
+    CANCEL_ORDER = struct.Struct("<Bq")                 # type, order_id
+    ACK_MESSAGE = struct.Struct("<Bqq")                 # type, order_id, quantity left after matching
+    FILL_MESSAGE = struct.Struct("<Bqqqqd")             # type, trade_id, order_id, counterparty order_id, quantity_filled, price
+    CANCELLED_MESSAGE = struct.Struct("<Bqq")           # type, order_id, quantity cancelled
+    REJECT_MESSAGE = struct.Struct("<Bq64s")            # type, order_id, utf-8 reason, truncated
+    SIDES, SIDE_NAMES = {"ask": 0, "bid": 1}, ("ask", "bid")
+    REQUESTS = {NEW: NEW_ORDER.size, CANCEL: CANCEL_ORDER.size}  # {type: body length}
+
+    @classmethod
+    def frame(cls, message: struct.Struct, *fields) -> bytes:
+        return cls.FRAME.pack(message.size) + message.pack(*fields)
+
+    @classmethod
+    def new_order(cls, order: Order) -> bytes:
+        return cls.frame(cls.NEW_ORDER, cls.NEW, order.order_id, order.symbol.encode(), cls.SIDES[order.side], order.price, order.quantity, order.account.encode(),
+                         order.expire_sec)
+
+    @classmethod
+    def cancel_order(cls, order_id: int) -> bytes:
+        return cls.frame(cls.CANCEL_ORDER, cls.CANCEL, order_id)
+
+    @classmethod
+    def messages(cls, view: memoryview):  # yields the body of every complete frame, a slice of view, and the bytes consumed so far
+        offset = 0
+        while offset + cls.FRAME.size <= len(view):
+            length, = cls.FRAME.unpack_from(view, offset)
+            if offset + cls.FRAME.size + length > len(view):
+                break
+            body = view[offset + cls.FRAME.size: offset + cls.FRAME.size + length]
+            offset += cls.FRAME.size + length
+            yield body, offset
+
+
+class OrderEntryHandler(BaseRequestHandler):  # one thread per persistent connection
+    P = OrderEntryProtocol
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.outbound = deque()  # replies and fills waiting for the writer, other sessions queue fills of our resting orders here
+        self.outbound_bytes = 0
+        self.outbound_ready = Condition()
+        self.closed = False
+        self.order_ids = set()
+        self.names = dict()      # {raw fixed width field: str}, symbols and accounts repeat on every order
+        self.writer = Thread(target=self.write, name=f"order-entry-writer-{self.client_address}", daemon=True)
+        self.writer.start()
+
+    def name(self, raw: bytes) -> str:
+        name = self.names.get(raw)
+        if name is None:
+            name = self.names[raw] = raw.rstrip(b"\0").decode()
+        return name
+
+    def send(self, data):  # never blocks, a socket write stalls only this session's writer
+        with self.outbound_ready:
+            if self.closed:
+                return
+            if self.outbound_bytes + len(data) > self.server.max_outbound:
+                self.disconnect()  # a slow consumer, it would otherwise hold its unread fills in memory without bound
+                return
+            self.outbound.append(data)
+            self.outbound_bytes += len(data)
+            self.outbound_ready.notify()
+
+    def write(self):
+        while True:
+            with self.outbound_ready:
+                while not self.outbound and not self.closed:
+                    self.outbound_ready.wait()
+                if not self.outbound:
+                    return
+                data = b"".join(self.outbound)  # everything queued meanwhile in one write
+                self.outbound.clear()
+                self.outbound_bytes = 0
+            try:
+                self.request.sendall(data)
+            except OSError:
+                with self.outbound_ready:
+                    self.disconnect()
+                return
+
+    def disconnect(self):  # outbound_ready is held
+        if self.closed:
+            return
+        self.closed = True
+        self.outbound.clear()
+        self.outbound_bytes = 0
+        self.outbound_ready.notify()
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)  # wakes handle() out of recv_into
+        except OSError:
+            pass
+
+    def handle(self):
+        buffer = bytearray(1 << 17)  # > largest frame, received into in place
+        view, end = memoryview(buffer), 0
+        while True:
+            try:
+                received = self.request.recv_into(view[end:])
+            except OSError:  # reset by the peer, or shut down as a slow consumer
+                return
+            if received == 0 or self.closed:
+                return
+            end += received
+            replies, orders, consumed = bytearray(), list(), 0
+            for body, consumed in self.P.messages(view[:end]):
+                if self.P.REQUESTS.get(body[0] if body else None) != len(body):
+                    replies += self.P.frame(self.P.REJECT_MESSAGE, self.P.REJECT, 0, b"Malformed message")
+                elif body[0] == self.P.NEW:
+                    _, order_id, symbol, side, price, quantity, account, expire_sec = self.P.NEW_ORDER.unpack_from(body)
+                    try:
+                        if side >= len(self.P.SIDE_NAMES):
+                            raise ValueError(f"Unknown side {side}")
+                        orders.append(Order(order_id, self.name(symbol), self.P.SIDE_NAMES[side], price, quantity, self.name(account), expire_sec))
+                    except ValueError as e:  # a bad side or a name that is not utf-8, the rest of the read is still processed
+                        replies += self.P.frame(self.P.REJECT_MESSAGE, self.P.REJECT, order_id, str(e).encode()[:64])
+                else:
+                    self.accept(orders, replies)  # keep the arrival order between new orders and cancels
+                    orders = list()
+                    self.cancel(self.P.CANCEL_ORDER.unpack_from(body)[1], replies)
+            self.accept(orders, replies)
+            if replies:
+                self.send(replies)  # one write for every reply to this read
+            if consumed:
+                buffer[:end - consumed] = buffer[consumed:end]  # keep the partial frame at the start
+                end -= consumed
+
+    def accept(self, orders: List[Order], replies: bytearray):
+        if not orders:
+            return
+        for order in orders:  # owned before matching, a batch mate resting when a later order fills it is reported by the server
+            self.server.owners[order.order_id] = self
+            self.order_ids.add(order.order_id)
+        for order, quantity, trades, error in self.server.engine.accept_orders(orders):  # one lock round trip per symbol for the whole read
+            if error is not None or order.quantity == 0:  # rejected or filled in full, never resting
+                self.server.forget(order.order_id)
+            if error is not None:
+                replies += self.P.frame(self.P.REJECT_MESSAGE, self.P.REJECT, order.order_id, str(error).encode()[:64])
+                continue
+            replies += self.P.frame(self.P.ACK_MESSAGE, self.P.ACK, order.order_id, quantity)
+            for trade in trades:  # the fills of the resting side go to their owners through the server
+                replies += self.fill(trade, trade.accepted_order, trade.matched_order)
+
+    def fill(self, trade: TradeRecord, order: Order, counterparty: Order) -> bytes:
+        return self.P.frame(self.P.FILL_MESSAGE, self.P.FILL, trade.trade_id, order.order_id, counterparty.order_id, trade.quantity_filled, trade.final_price)
+
+    def cancel(self, order_id: int, replies: bytearray):
+        try:
+            order = self.server.engine.cancel_order(order_id)  # the server forgets it as the engine removes it
+            replies += self.P.frame(self.P.CANCELLED_MESSAGE, self.P.CANCELLED, order_id, order.quantity)
+        except ValueError as e:
+            replies += self.P.frame(self.P.REJECT_MESSAGE, self.P.REJECT, order_id, str(e).encode()[:64])
+
+    def finish(self):
+        for order_id in list(self.order_ids):  # other threads discard from it as orders leave the book
+            if self.server.owners.get(order_id) is self:
+                self.server.owners.pop(order_id, None)  # orders stay in the book, their later fills are not reported
+        with self.outbound_ready:
+            self.closed = True  # the writer sends what is queued, then exits
+            self.outbound_ready.notify()
+        self.writer.join(5)  # a peer that stopped reading cannot hold the session open, the socket is closed next
+
+
+class OrderEntryServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, engine: MatchingEngine, host: str = "localhost", port: int = 9990, max_outbound: int = 1 << 22):
+        super().__init__((host, port), OrderEntryHandler)
+        self.engine = engine  # shared with the web service, its book locks make it safe across connections
+        self.owners = dict()  # {resting order_id: handler of the session that sent it}, pruned as orders leave the book however they leave it
+        self.max_outbound = max_outbound  # bytes a session may leave unread before it is disconnected
+        engine.listeners.append(self)
+
+    def trade(self, trade: TradeRecord):  # engine listener, under a book lock, send() only queues
+        sides = [(trade.matched_order, trade.accepted_order, trade.matched_quantity)]  # the aggressor of a continuous trade is answered by its own session
+        if trade.price is not None:  # an auction cross, both orders were resting
+            sides.append((trade.accepted_order, trade.matched_order, trade.accepted_quantity))
+        for order, counterparty, quantity in sides:
+            owner = self.owners.get(order.order_id)
+            if owner is not None:
+                if quantity == trade.quantity_filled:
+                    self.forget(order.order_id)
+                owner.send(owner.fill(trade, order, counterparty))
+
+    def removed(self, order_id: int):  # engine listener, cancelled or expired
+        self.forget(order_id)
+
+    def forget(self, order_id: int):
+        owner = self.owners.pop(order_id, None)
+        if owner is not None:
+            owner.order_ids.discard(order_id)
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.serve_forever, name="order-entry", daemon=True)
+        thread.start()
+        return thread
+
+
+PARSER = argparse.ArgumentParser(description="Binary order entry over TCP")
+PARSER.add_argument("-H", "--host", dest="host", default="localhost", help="Host or IP")
+PARSER.add_argument("-p", "--port", dest="port", default=9990, type=int, help="Port")
+PARSER.add_argument("-s", "--symbols", dest="symbols", default="AAPL,MSFT", help="Trading Symbols with optional tick sizes, e.g. AAPL:0.01,MSFT, delimiter = ','")
+PARSER.add_argument("-m", "--max-outbound", dest="max_outbound", default=1 << 22, type=int, help="Unread bytes after which a slow session is disconnected")
+if __name__ == "__main__":
+    ARGUMENTS = PARSER.parse_args()
+    engine = MatchingEngine()
+    engine.load_symbols(*parse_symbols(ARGUMENTS.symbols))
+    engine.start_sweeper()
+    with OrderEntryServer(engine, ARGUMENTS.host, ARGUMENTS.port, ARGUMENTS.max_outbound) as server:
+        try:
+            server.serve_forever()
+        finally:
+            engine.close()
+
+
+"""
+python order_matching_tcp.py -p 9990 -s AAPL,MSFT
+python order_matching_service.py -p 9999 -b 9990  # same engine behind HTTP and TCP
+
+import socket
+from order_matching_engine import Order
+from order_matching_tcp import OrderEntryProtocol as P
+s = socket.create_connection(("localhost", 9990))
+s.sendall(P.new_order(Order(1, "MSFT", "ask", 200, 3, "Trader_A", 20)) + P.new_order(Order(2, "MSFT", "bid", 210, 5, "Trader_B", 20)))
+data = memoryview(s.recv(4096))
+[(chr(body[0]), P.ACK_MESSAGE.unpack_from(body) if body[0] == P.ACK else P.FILL_MESSAGE.unpack_from(body)) for body, _ in P.messages(data)]
+s.sendall(P.cancel_order(2))
+"""
@@ -0,0 +1,95 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+from order_matching_engine import EventLog, LatencyHistogram, MatchingEngine, Order, parse_symbols
+from time import perf_counter_ns
+
+
+class SimulatedClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def read_rows(path: str, file_format: str):
+    with (sys.stdin if path == "-" else open(path, newline="")) as f:
+        if file_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def replay(rows, interval: float = 0.001, history_capacity: int = 100000, tick_sizes: dict = None) -> dict:
+    quiet_logger = logging.getLogger("order_replay")
+    quiet_logger.disabled = True
+    clock = SimulatedClock()
+    engine = MatchingEngine(logger=quiet_logger, history_capacity=history_capacity, clock=clock, event_level=EventLog.OFF)
+    latency = LatencyHistogram()
+    orders, cancels, rejects, engine_ns = 0, 0, 0, 0
+    wall_start = perf_counter_ns()
+    for row in rows:
+        clock.now = float(row["time"]) if row.get("time") not in (None, "") else clock.now + interval  # expiries follow the file, not the host
+        if (row.get("action") or "accept") == "cancel":
+            start = perf_counter_ns()
+            try:
+                engine.cancel_order(int(row["order_id"]))
+                cancels += 1
+            except ValueError:
+                rejects += 1
+            elapsed = perf_counter_ns() - start
+        else:
+            order = Order(int(row["order_id"]), row["symbol"], row["side"], float(row["price"]), int(row["quantity"]), row["account"], float(row["expire_sec"]), clock.now)
+            if order.symbol not in engine.queues:
+                engine.load_symbols([order.symbol], tick_sizes)
+            start = perf_counter_ns()
+            try:
+                engine.accept_order(order)
+                orders += 1
+            except ValueError:  # off tick price
+                rejects += 1
+            elapsed = perf_counter_ns() - start
+        latency.record(elapsed)
+        engine_ns += elapsed
+    wall_sec = (perf_counter_ns() - wall_start) / 1e9
+    engine_sec = engine_ns / 1e9
+    p50, p90, p99, p999 = latency.percentiles([50, 90, 99, 99.9])
+    return {
+        "orders": orders, "cancels": cancels, "rejects": rejects, "fills": engine.history.total,
+        "wall_sec": round(wall_sec, 6), "engine_sec": round(engine_sec, 6),
+        "orders_per_sec": round((orders + cancels) / engine_sec, 1) if engine_sec else 0.0,
+        "fills_per_sec": round(engine.history.total / engine_sec, 1) if engine_sec else 0.0,
+        "latency_us": {"p50": p50 / 1e3, "p90": p90 / 1e3, "p99": p99 / 1e3, "p99.9": p999 / 1e3, "max": latency.max / 1e3}
+    }
+
+
+PARSER = argparse.ArgumentParser(description="Replay an order file through MatchingEngine without the web service")
+PARSER.add_argument("file", help="CSV with a header or NDJSON, columns: order_id,symbol,side,price,quantity,account,expire_sec[,time][,action], '-' for stdin")
+PARSER.add_argument("-f", "--format", dest="format", default=None, choices=["csv", "ndjson"], help="Default: by file extension")
+PARSER.add_argument("-i", "--interval", dest="interval", default=0.001, type=float, help="Simulated seconds between rows without a time column")
+PARSER.add_argument("-c", "--history-capacity", dest="history_capacity", default=100000, type=int, help="Trades kept in memory")
+PARSER.add_argument("-t", "--tick-sizes", dest="tick_sizes", default=None, help="Tick size per symbol, e.g. AAPL:0.01,MSFT:0.05, others use the default")
+PARSER.add_argument("-j", "--json", dest="json", action="store_true", help="Print the report as json")
+if __name__ == "__main__":
+    ARGUMENTS = PARSER.parse_args()
+    file_format = ARGUMENTS.format or ("csv" if ARGUMENTS.file.endswith(".csv") else "ndjson")
+    tick_sizes = parse_symbols(ARGUMENTS.tick_sizes)[1] if ARGUMENTS.tick_sizes else None
+    report = replay(read_rows(ARGUMENTS.file, file_format), ARGUMENTS.interval, ARGUMENTS.history_capacity, tick_sizes)
+    if ARGUMENTS.json:
+        print(json.dumps(report))
+    else:
+        print(f"Orders: {report['orders']}, Cancels: {report['cancels']}, Rejects: {report['rejects']}, Fills: {report['fills']}")
+        print(f"Wall: {report['wall_sec']:.3f}s, Engine: {report['engine_sec']:.3f}s")
+        print(f"Throughput: {report['orders_per_sec']:.0f} orders/s, {report['fills_per_sec']:.0f} fills/s")
+        print("Latency (us): " + ", ".join(f"{name} {value:.1f}" for name, value in report["latency_us"].items()))
+
+
+"""
+python order_replay.py orders.csv
+python order_replay.py orders.ndjson --json
+"""
@@ -0,0 +1,274 @@
+import json
+import random
+import pytest
+from threading import Event, Thread
+import order_matching_engine
+from order_matching_engine import EventLog, Journal, MatchingEngine, Order, TimerWheel, TradeHistory, TradeRecord, clearing_price
+
+
+def book_state(engine: MatchingEngine) -> dict:
+    return {(symbol, side): [(order.order_id, order.ticks, order.quantity) for order in queue]
+            for symbol, sides in engine.queues.items() for side, queue in sides.items()}
+
+
+def test_journal_snapshot_and_tail_recover_the_same_books(tmp_path):
+    rng = random.Random(3)
+    journal = Journal(str(tmp_path))
+    engine = MatchingEngine(journal=journal, event_level=EventLog.OFF)
+    engine.load_symbols(["X", "Y"])
+    for i in range(2000):
+        choice = rng.random()
+        if choice < 0.2 and engine.db:
+            engine.cancel_order(rng.choice(list(engine.db)))
+        elif choice < 0.25 and engine.db:
+            old_order = engine.db[rng.choice(list(engine.db))]
+            engine.replace_order(old_order.order_id, Order(10 ** 6 + i, old_order.symbol, old_order.side, rng.randint(95, 105), rng.randint(1, 10), "B", 600))
+        else:
+            engine.accept_order(Order(i, rng.choice("XY"), rng.choice(("ask", "bid")), rng.randint(95, 105), rng.randint(1, 10), rng.choice("AB"), 600))
+        if i == 1000:
+            engine.snapshot()  # later records only go to the tail segment
+    journal.close()
+    engine.close()
+    assert len(journal.list_files("snapshot")) == 1
+
+    recovered_journal = Journal(str(tmp_path))
+    recovered = MatchingEngine(journal=recovered_journal, event_level=EventLog.OFF)
+    recovered.recover()
+    recovered_journal.close()
+    recovered.close()
+    assert book_state(recovered) == book_state(engine)
+    assert set(recovered.db) == set(engine.db)
+
+
+def test_wheel_never_expires_early_and_at_most_one_tick_late():
+    rng = random.Random(5)
+    now = 1000.0
+    wheel = TimerWheel(now=now)
+    pending = dict()
+    for order_id in range(3000):
+        if rng.random() < 0.5:
+            order = Order(order_id, "X", "ask", 1, 1, "A", rng.choice((0.05, 0.3, 2, rng.uniform(0, 600), rng.uniform(0, 10 ** 6))), now)
+            wheel.add(order)
+            pending[order_id] = order
+        elif rng.random() < 0.1 and pending:
+            wheel.remove(pending.pop(rng.choice(list(pending))).order_id)
+        else:
+            now += rng.choice((0.01, 0.1, 0.35, 5, 300, rng.uniform(0, 10 ** 5)))
+            for order in wheel.advance(now):
+                assert order.expire_at <= now
+                del pending[order.order_id]
+            assert all(order.expire_at + wheel.tick_sec * 1.001 > now for order in pending.values())
+            assert len(wheel) == len(pending)
+
+
+def test_wheel_expires_across_a_long_idle_gap():
+    wheel = TimerWheel(now=0)
+    orders = [Order(order_id, "X", "ask", 1, 1, "A", expire_sec, 0) for order_id, expire_sec in enumerate((60, 3600, 5 * 3600, 10 * 3600, 10 ** 7))]
+    for order in orders:
+        wheel.add(order)
+    assert wheel.advance(1) == []
+    assert sorted(order.order_id for order in wheel.advance(8 * 3600)) == [0, 1, 2]
+    assert sorted(wheel.timers) == [3, 4]
+    assert [order.order_id for order in wheel.advance(10 * 3600 + wheel.tick_sec)] == [3]
+
+
+def brute_force_clearing_price(asks: list, bids: list):
+    ranked = list()
+    for price in sorted({ticks for ticks, _ in asks + bids}):
+        supply = sum(quantity for ticks, quantity in asks if ticks <= price)
+        demand = sum(quantity for ticks, quantity in bids if ticks >= price)
+        ranked.append((min(supply, demand), abs(demand - supply), price))
+    volume = max((volume for volume, _, _ in ranked), default=0)
+    if volume == 0:
+        return None, 0
+    imbalance = min(imbalance for candidate_volume, imbalance, _ in ranked if candidate_volume == volume)
+    candidates = [price for candidate_volume, candidate_imbalance, price in ranked if (candidate_volume, candidate_imbalance) == (volume, imbalance)]
+    return candidates[(len(candidates) - 1) // 2], volume
+
+
+def random_books(seed: int, count: int = 300):
+    rng = random.Random(seed)
+    for _ in range(count):
+        asks = [(rng.randint(90, 110), rng.randint(1, 50)) for _ in range(rng.randint(0, 12))]
+        bids = [(rng.randint(90, 110), rng.randint(1, 50)) for _ in range(rng.randint(0, 12))]
+        yield asks, bids
+
+
+def clear(asks: list, bids: list):
+    return clearing_price([ticks for ticks, _ in asks], [quantity for _, quantity in asks], [ticks for ticks, _ in bids], [quantity for _, quantity in bids])
+
+
+def test_pure_python_clearing_price_matches_brute_force(monkeypatch):
+    monkeypatch.setattr(order_matching_engine, "np", None)
+    for asks, bids in random_books(11):
+        assert clear(asks, bids) == brute_force_clearing_price(asks, bids)
+
+
+def test_numpy_clearing_price_matches_pure_python(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    monkeypatch.setattr(order_matching_engine, "np", numpy)
+    books = list(random_books(13))
+    vectorized = [clear(asks, bids) for asks, bids in books]
+    monkeypatch.setattr(order_matching_engine, "np", None)
+    assert vectorized == [clear(asks, bids) for asks, bids in books]
+    assert vectorized == [brute_force_clearing_price(asks, bids) for asks, bids in books]
+
+
+def make_trade(trade_number: int) -> TradeRecord:
+    symbol = "A" if trade_number % 2 == 0 else "B"
+    accepted = Order(2 * trade_number + 1, symbol, "bid", 100, 1, "Taker", 600)
+    matched = Order(2 * trade_number, symbol, "ask", 100, 1, "Maker", 600)
+    return TradeRecord(accepted, matched, 1, 1, 1, 1000.0 + trade_number)
+
+
+def test_history_cursor_skips_trades_evicted_between_pages():
+    history = TradeHistory(capacity=10)
+    for trade_number in range(8):
+        history.append(make_trade(trade_number))
+    page, cursor = history.query(cursor=0, limit=3)
+    assert [record.trade_id for record in page] == [0, 1, 2] and cursor == 3
+
+    for trade_number in range(8, 18):  # trades 0 to 7 leave the ring
+        history.append(make_trade(trade_number))
+    page, cursor = history.query(cursor=cursor, limit=3)
+    assert [record.trade_id for record in page] == [8, 9, 10] and cursor == 11
+    trade_ids = [record.trade_id for record in page]
+    while cursor < history.total:
+        page, cursor = history.query(cursor=cursor, limit=3)
+        trade_ids.extend(record.trade_id for record in page)
+    assert trade_ids == list(range(8, 18)) and cursor == 18
+
+    page, cursor = history.query(symbol="A", cursor=0, limit=100)
+    assert [record.trade_id for record in page] == [8, 10, 12, 14, 16] and cursor == 18
+
+
+def test_history_spills_evicted_trades_in_order(tmp_path):
+    spill_path = str(tmp_path / "spill.ndjson")
+    history = TradeHistory(capacity=10, spill_path=spill_path)
+    for trade_number in range(25):
+        history.append(make_trade(trade_number))
+    history.close()  # waits for the spill thread to write out its queue
+    with open(spill_path) as f:
+        assert [json.loads(line)["trade_id"] for line in f] == list(range(15))
+    assert [record.trade_id for record in history] == list(range(15, 25))
+
+
+def test_level_fills_in_arrival_order_and_keeps_its_totals():
+    engine = MatchingEngine(event_level=EventLog.OFF)
+    engine.load_symbols(["X"])
+    for order_id, quantity in ((1, 5), (2, 3), (3, 4)):
+        engine.accept_order(Order(order_id, "X", "ask", 100, quantity, "A", 600))
+    engine.accept_order(Order(4, "X", "ask", 99, 2, "A", 600))  # a better price still goes first
+    asks = engine.queues["X"]["ask"]
+    assert [order.order_id for order in asks] == [4, 1, 2, 3]
+    assert asks.depth() == [{"price": 99, "quantity": 2, "orders": 1}, {"price": 100, "quantity": 12, "orders": 3}]
+
+    engine.accept_order(Order(5, "X", "bid", 100, 9, "B", 600))
+    trades, _ = engine.history.query()
+    assert [(trade.matched_order.order_id, trade.quantity_filled) for trade in trades] == [(4, 2), (1, 5), (2, 2)]
+    assert [(order.order_id, order.quantity) for order in asks] == [(2, 1), (3, 4)]  # the partly filled order keeps its place
+    assert asks.depth() == [{"price": 100, "quantity": 5, "orders": 2}]
+
+    engine.accept_order(Order(6, "X", "ask", 100, 1, "A", 600))  # joins the back of the level
+    engine.accept_order(Order(7, "X", "bid", 100, 5, "B", 600))
+    trades, _ = engine.history.query(cursor=3)
+    assert [(trade.matched_order.order_id, trade.quantity_filled) for trade in trades] == [(2, 1), (3, 4)]
+    assert [order.order_id for order in asks] == [6] and set(engine.db) == {6}
+    engine.close()
+
+
+def test_mass_cancel_and_replace():
+    engine = MatchingEngine(event_level=EventLog.OFF)
+    engine.load_symbols(["X", "Y"])
+    for order_id, (symbol, side, price, account) in enumerate((("X", "ask", 101, "A"), ("X", "bid", 99, "A"), ("Y", "ask", 101, "A"),
+                                                                ("X", "ask", 102, "B"), ("Y", "bid", 99, "B"))):
+        engine.accept_order(Order(order_id, symbol, side, price, 5, account, 600))
+    assert sorted(order.order_id for order in engine.cancel_orders(account="A", symbol="X")) == [0, 1]
+    assert sorted(engine.db) == [2, 3, 4] and "A" not in engine.queues["X"]["ask"].accounts
+    assert [order.order_id for order in engine.cancel_orders(account="A")] == [2]
+    assert sorted(order.order_id for order in engine.cancel_orders(symbol="Y")) == [4]
+    assert list(engine.db) == [3]
+    with pytest.raises(ValueError):
+        engine.cancel_orders()
+
+    engine.accept_order(Order(5, "X", "bid", 100, 4, "C", 600))
+
+    class Sequences:  # listeners run under the symbol lock, so they see the sequence of the critical section they are called from
+        def __init__(self):
+            self.seen = list()
+
+        def trade(self, trade):
+            self.seen.append(("trade", trade.accepted_order.order_id, engine.locks["X"].sequence))
+
+        def removed(self, order_id):
+            self.seen.append(("removed", order_id, engine.locks["X"].sequence))
+
+    sequences = Sequences()
+    engine.listeners.append(sequences)
+    old_order, trades = engine.replace_order(5, Order(6, "X", "bid", 102, 7, "C", 600))  # crosses the ask it used to sit under
+    assert old_order.order_id == 5 and [(trade.matched_order.order_id, trade.quantity_filled) for trade in trades] == [(3, 5)]
+    assert [(event, order_id) for event, order_id, _ in sequences.seen] == [("removed", 5), ("trade", 6)]
+    assert len({sequence for _, _, sequence in sequences.seen}) == 1 and sequences.seen[0][2] % 2 == 1  # one lock round trip
+    assert list(engine.db) == [6] and engine.db[6].quantity == 2
+    assert [order.order_id for order in engine.queues["X"]["bid"]] == [6] and not engine.queues["X"]["ask"]
+
+    with pytest.raises(ValueError):
+        engine.replace_order(5, Order(7, "X", "bid", 100, 1, "C", 600))
+    with pytest.raises(ValueError):
+        engine.replace_order(6, Order(8, "Y", "bid", 100, 1, "C", 600))
+    assert list(engine.db) == [6]
+    engine.close()
+
+
+def test_concurrent_accepts_never_cross_the_book():
+    engine = MatchingEngine(event_level=EventLog.OFF)
+    engine.load_symbols(["X", "Y"])
+    done, submitted, crossed, errors = Event(), list(), list(), list()
+
+    def touch(symbol: str):
+        asks, bids = engine.queues[symbol]["ask"], engine.queues[symbol]["bid"]
+        return asks.peek().ticks if asks else None, bids.peek().ticks if bids else None
+
+    def check():  # copies the touch between critical sections, as the views do
+        while not done.is_set():
+            for symbol in ("X", "Y"):
+                _, (ask, bid) = engine.read_book(symbol, lambda: touch(symbol))
+                if ask is not None and bid is not None and ask <= bid:
+                    crossed.append((symbol, ask, bid))
+
+    def submit(thread: int):
+        rng = random.Random(thread)
+        try:
+            for i in range(1500):
+                order = Order(thread * 10 ** 6 + i, rng.choice("XY"), rng.choice(("ask", "bid")), rng.randint(95, 105), rng.randint(1, 10), "A", 600)
+                submitted.append((order.symbol, order.side, order.quantity))
+                if i % 10 == 0:
+                    engine.accept_orders([order])  # batches take the lock alongside the coalesced single accepts
+                else:
+                    engine.accept_order(order)
+        except Exception as e:
+            errors.append(e)
+
+    checker = Thread(target=check)
+    checker.start()
+    threads = [Thread(target=submit, args=(thread,)) for thread in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    checker.join()
+    assert errors == [] and crossed == [] and len(submitted) == 6 * 1500
+
+    resting = {order.order_id: order for sides in engine.queues.values() for side in sides.values() for order in side}
+    assert resting.keys() == engine.db.keys()
+    trades, _ = engine.history.query(limit=len(engine.history))
+    assert len({trade.trade_id for trade in trades}) == len(trades) == engine.history.total
+    for symbol in ("X", "Y"):
+        ask, bid = touch(symbol)
+        assert ask is None or bid is None or ask > bid
+        filled = sum(trade.quantity_filled for trade in trades if trade.accepted_order.symbol == symbol)
+        for side in ("ask", "bid"):  # every unit submitted either rests or was filled against the other side
+            resting_quantity = sum(row["quantity"] for row in engine.queues[symbol][side].depth())
+            assert sum(quantity for order_symbol, order_side, quantity in submitted if (order_symbol, order_side) == (symbol, side)) == resting_quantity + filled
+    engine.close()